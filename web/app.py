@@ -1,24 +1,43 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g as request_ctx, render_template, request, jsonify
 from flask_cors import CORS
-import io
+import base64
+import contextlib
+import contextvars
+import functools
+import hashlib
+import heapq
+import importlib
+import itertools
 import json
-import math
+import multiprocessing
 import os
 import random
+import sqlite3
+import sys
 import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 
-try:
-    from stl import mesh
-    _HAVE_NUMPY_STL = True
-except Exception:
-    _HAVE_NUMPY_STL = False
+# numpy-stl y trimesh solo hacen falta para generar mallas con ellos y tardan más
+# en importarse que Flask: se cargan la primera vez que se usan para que arrancar
+# un worker (y responder a /health) no las pague
+@functools.lru_cache(maxsize=None)
+def optional_module(name):
+    """El módulo name importado, o None si no está instalado."""
+    try:
+        return importlib.import_module(name)
+    except Exception:
+        return None
 
-try:
-    import trimesh
-    _HAVE_TRIMESH = True
-except Exception:
-    _HAVE_TRIMESH = False
+def warm_export_stack():
+    """Importa de antemano las dependencias de malla. Con preload_app de Gunicorn
+    (gunicorn.conf.py) se llama en el proceso maestro y los workers las heredan."""
+    return {name: optional_module(name) is not None for name in ('stl.mesh', 'trimesh')}
 
 app = Flask(__name__)
 ALLOWED_ORIGINS = [o.strip() for o in os.environ.get("ALLOWED_ORIGINS", "*").split(",") if o.strip()] or ["*"]
@@ -50,6 +69,9 @@ STL_GAP_MM = 5.0
 STL_BASE_BORDER_SIZE_MM = 5.0
 STL_BASE_THICKNESS_MM = 1.0
 STL_BASE_WALL_HEIGHT_MM = 2.0
+# Cama de la impresora para repartir base y piezas en placas
+PRINT_BED_WIDTH_MM = float(os.environ.get('PRINT_BED_WIDTH_MM', 220.0))
+PRINT_BED_DEPTH_MM = float(os.environ.get('PRINT_BED_DEPTH_MM', 220.0))
 
 PIECE_COLORS = [
     "#FF6666", "#FFCC66", "#99CC66", "#66CCCC", "#6699CC",
@@ -68,139 +90,486 @@ def neighbors(cell, M, N):
         if 0 <= nr < M and 0 <= nc < N:
             yield (nr, nc)
 
+# =============================
+# MÉTRICAS
+# =============================
+# Contadores e histogramas en memoria, expuestos en /metrics en formato de texto
+# de Prometheus. Son por proceso: con varios workers de Gunicorn cada uno
+# publica los suyos. stage() mide una etapa (generación, partición, búsqueda,
+# malla...) y, dentro de una petición, la apunta también para Server-Timing.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() == 'true'
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '').lower() == 'true'
+PROFILE_INTERVAL = 0.005
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+METRICS = {
+    'puzzle_stage_seconds': ('histogram', 'Duración de cada etapa', TIME_BUCKETS),
+    'puzzle_http_request_seconds': ('histogram', 'Duración de las peticiones HTTP', TIME_BUCKETS),
+    'puzzle_http_requests_total': ('counter', 'Peticiones HTTP atendidas', None),
+    'puzzle_solver_nodes_total': ('counter', 'Nodos visitados por el exact cover', None),
+    'puzzle_solver_dead_ends_total': ('counter', 'Nodos sin salida del exact cover', None),
+    'puzzle_solver_solutions_total': ('counter', 'Soluciones encontradas', None),
+    'puzzle_solver_placements_per_group': ('histogram', 'Colocaciones candidatas por grupo de piezas', COUNT_BUCKETS),
+}
+
+_metric_values = {}
+_metrics_lock = threading.Lock()
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+def metric_inc(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _metric_values[key] = _metric_values.get(key, 0) + value
+
+def metric_observe(name, value, **labels):
+    buckets = METRICS[name][2]
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        hist = _metric_values.get(key)
+        if hist is None:
+            hist = _metric_values[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                hist[i] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+def render_metrics():
+    def fmt(labels):
+        return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}' if labels else ''
+
+    with _metrics_lock:
+        values = sorted(_metric_values.items(), key=lambda item: item[0])
+        values = [(key, list(v) if isinstance(v, list) else v) for key, v in values]
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, labels), value in values:
+            if metric != name:
+                continue
+            if kind == 'counter':
+                lines.append(f'{name}{fmt(labels)} {value}')
+                continue
+            for bound, count in zip(buckets, value):
+                lines.append(f'{name}_bucket{fmt(labels + (("le", bound),))} {count}')
+            lines.append(f'{name}_bucket{fmt(labels + (("le", "+Inf"),))} {value[-1]}')
+            lines.append(f'{name}_sum{fmt(labels)} {value[-2]}')
+            lines.append(f'{name}_count{fmt(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metric_observe('puzzle_stage_seconds', elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+def timed_stage(name):
+    """Decorador: la función entera cuenta como la etapa name."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_iter(name, iterable):
+    """Itera iterable sumando el tiempo pasado dentro de él como la etapa name.
+    Sirve para generadores perezosos, como la serialización del STL."""
+    elapsed = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        metric_observe('puzzle_stage_seconds', elapsed, stage=name)
+
+def server_timing(timings, total):
+    """Cabecera Server-Timing: duración sumada por etapa, en ms."""
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    parts = [f'{name};dur={elapsed * 1000:.2f}' for name, elapsed in totals.items()]
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+class StackSampler:
+    """Perfilador por muestreo: cada interval segundos apunta la pila de un hilo.
+    El intervalo real no baja del de cambio de hilo del intérprete (5 ms)."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                key = tuple(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def report(self, top=25):
+        """Funciones con más muestras (propias y acumuladas) y las pilas
+        colapsadas, que se pueden pasar a flamegraph.pl."""
+        own, total = {}, {}
+        for stack, count in self.stacks.items():
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+            for fn in set(stack):
+                total[fn] = total.get(fn, 0) + count
+        lines = [f'{self.samples} muestras cada {self.interval * 1000:.1f} ms', '', 'propias:']
+        lines += [f'{count:6d}  {fn}' for fn, count in sorted(own.items(), key=lambda x: -x[1])[:top]]
+        lines += ['', 'acumuladas:']
+        lines += [f'{count:6d}  {fn}' for fn, count in sorted(total.items(), key=lambda x: -x[1])[:top]]
+        lines += ['', 'pilas:']
+        lines += [f"{';'.join(stack)} {count}" for stack, count in sorted(self.stacks.items(), key=lambda x: -x[1])]
+        return '\n'.join(lines) + '\n'
+
+# =============================
+# TABLERO EN BITS
+# =============================
+# La celda (r, c) de un tablero MxN es el bit r*N + c de un int de Python.
+# Conjuntos de celdas, piezas y colocaciones son un único entero: solapes,
+# uniones e inclusiones pasan a ser AND/OR sin crear sets en los bucles.
+def cells_to_mask(cells, N):
+    mask = 0
+    for r, c in cells:
+        mask |= 1 << (r * N + c)
+    return mask
+
+def iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def mask_to_cells(mask, N):
+    """Celdas (r, c) del mask en orden de fila (igual que sorted())."""
+    return [divmod(b, N) for b in iter_bits(mask)]
+
+def grid_mask(grid):
+    """Mask de las celdas a cubrir (normales y de aire, todo lo que no es 0).
+    Acepta el array int8 de generate_grid o listas anidadas."""
+    cover = np.asarray(grid) != 0
+    return int.from_bytes(np.packbits(cover.ravel(), bitorder='little').tobytes(), 'little')
+
+def grid_to_json(grid):
+    return np.asarray(grid).tolist()
+
+def mask_to_array(mask, M, N):
+    """Mask como array booleano MxN."""
+    raw = np.frombuffer(mask.to_bytes((M * N + 7) // 8 or 1, 'little'), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder='little')[:M * N].reshape(M, N).astype(bool)
+
 # =============================
 # PARTITION ALGORITHMS
 # =============================
-def greedy_partition_basic(grid, min_size=1, max_size=4, attempts_per_cell=30):
+# Toda la aleatoriedad sale del rng que se pasa (un random.Random o una
+# semilla), nunca del módulo random global: con la misma semilla se obtiene la
+# misma partición y los hilos no se pisan el estado.
+SEED_BITS = 32
+
+def make_rng(rng=None):
+    """random.Random a partir de una semilla, un Random existente, un
+    np.random.Generator o None (aleatorio)."""
+    if isinstance(rng, random.Random):
+        return rng
+    if isinstance(rng, np.random.Generator):
+        return random.Random(int(rng.integers(2**63)))
+    return random.Random(rng)
+
+def make_numpy_rng(rng=None):
+    """np.random.Generator para el código vectorizado; un Random se usa para
+    sembrarlo, así que sigue avanzando igual que con make_rng."""
+    if isinstance(rng, np.random.Generator):
+        return rng
+    return np.random.default_rng(make_rng(rng).getrandbits(64))
+
+def new_seed():
+    return random.SystemRandom().getrandbits(SEED_BITS)
+
+@functools.lru_cache(maxsize=64)
+def neighbor_lists(M, N):
+    """Tabla bit -> bits de sus vecinos ortogonales, en orden creciente."""
+    return tuple(tuple(sorted(r * N + c for r, c in neighbors(divmod(b, N), M, N))) for b in range(M * N))
+
+class RandomAccessSet:
+    """Conjunto con alta, baja y elección aleatoria en O(1): la baja mueve el
+    último elemento al hueco en lugar de desplazar la lista."""
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.pos = {x: i for i, x in enumerate(self.items)}
+
+    def __len__(self):
+        return len(self.items)
+
+    def remove(self, x):
+        i = self.pos.pop(x)
+        last = self.items.pop()
+        if i < len(self.items):
+            self.items[i] = last
+            self.pos[last] = i
+
+    def choice(self, rng):
+        return self.items[rng.randrange(len(self.items))]
+
+class DegreeQueue:
+    """Celdas libres por número de vecinos libres, para sacar la de más vecinos
+    (la de bit menor si empatan). Una cola por grado con borrado perezoso: al
+    bajar el grado de una celda se apunta de nuevo y la entrada vieja se
+    descarta cuando llega arriba."""
+
+    def __init__(self, cells, degree, free):
+        self.degree = degree
+        self.free = free
+        self.buckets = [[] for _ in range(5)]
+        for x in cells:
+            self.buckets[degree[x]].append(x)
+        for bucket in self.buckets:
+            heapq.heapify(bucket)
+
+    def update(self, x):
+        heapq.heappush(self.buckets[self.degree[x]], x)
+
+    def peek_max(self):
+        for d in range(4, -1, -1):
+            bucket = self.buckets[d]
+            while bucket and (not self.free[bucket[0]] or self.degree[bucket[0]] != d):
+                heapq.heappop(bucket)
+            if bucket:
+                return bucket[0]
+        return None
+
+def partition_state(grid):
+    """(N, vecinos, celdas a cubrir, marcas de celda libre) para los particionadores."""
     M, N = len(grid), len(grid[0])
-    unassigned = {(r,c) for r in range(M) for c in range(N) if grid[r][c] == 1 or grid[r][c] == -1}
+    cover = (np.asarray(grid) != 0).ravel()
+    cells = np.flatnonzero(cover).tolist()
+    free = bytearray(cover.astype(np.uint8).tobytes())
+    return N, neighbor_lists(M, N), cells, free
+
+def grow_piece(piece, target_size, free, nbl, rng, attempts=None):
+    """Hace crecer piece (lista de bits ya marcados como ocupados) eligiendo al
+    azar una celda de la frontera y uno de sus vecinos libres. La frontera
+    se quita por intercambio con el último. attempts limita las celdas añadidas."""
+    frontier = list(piece)
+    added = 0
+    while len(piece) < target_size and frontier and (attempts is None or added < attempts):
+        i = rng.randrange(len(frontier))
+        nbrs = [n for n in nbl[frontier[i]] if free[n]]
+        if not nbrs:
+            frontier[i] = frontier[-1]
+            frontier.pop()
+            continue
+        newcell = rng.choice(nbrs)
+        free[newcell] = 0
+        piece.append(newcell)
+        frontier.append(newcell)
+        added += 1
+    return piece
+
+def fill_to_min(piece, min_size, free, nbl, repeat=False):
+    """Completa piece hasta min_size con vecinos libres, recorriendo sus celdas
+    en orden; con repeat vuelve a pasar mientras siga añadiendo."""
+    added = True
+    while len(piece) < min_size and added:
+        added = False
+        for b in sorted(piece):
+            for n in nbl[b]:
+                if free[n]:
+                    free[n] = 0
+                    piece.append(n)
+                    added = True
+                    if len(piece) >= min_size:
+                        return piece
+        if not repeat:
+            break
+    return piece
+
+# Las celdas libres se marcan en un bytearray (libre = sin asignar y fuera de
+# la pieza en curso) y las celdas sin asignar se eligen de un RandomAccessSet,
+# así que cada paso cuesta O(1) y un tablero de 100x100 se parte en tiempo lineal.
+def greedy_partition_basic(grid, min_size=1, max_size=4, attempts_per_cell=30, rng=None):
+    rng = make_rng(rng)
+    N, nbl, cells, free = partition_state(grid)
+    unassigned = RandomAccessSet(cells)
     pieces = []
     while unassigned:
-        seed = random.choice(list(unassigned))
-        target_size = random.randint(min_size, max_size)
-        for _ in range(attempts_per_cell):
-            piece = {seed}
-            frontier = [seed]
-            while len(piece) < target_size and frontier:
-                cell = random.choice(frontier)
-                nbrs = [n for n in neighbors(cell, M, N) if n in unassigned and n not in piece]
-                if not nbrs:
-                    frontier.remove(cell)
-                    continue
-                newcell = random.choice(nbrs)
-                piece.add(newcell)
-                frontier.append(newcell)
+        seed = unassigned.choice(rng)
+        target_size = rng.randint(min_size, max_size)
+        free[seed] = 0
+        piece = [seed]
+        for attempt in range(attempts_per_cell):
+            if attempt:
+                for b in piece[1:]:
+                    free[b] = 1
+                piece = [seed]
+            grow_piece(piece, target_size, free, nbl, rng)
             if len(piece) == target_size:
                 break
-        pieces.append(sorted(piece))
-        for c in piece:
-            if c in unassigned:
-                unassigned.remove(c)
+        for b in piece:
+            unassigned.remove(b)
+        pieces.append([divmod(b, N) for b in sorted(piece)])
     return pieces
 
-def greedy_partition_force_min(grid, min_size=1, max_size=4, attempts_per_cell=50):
-    M, N = len(grid), len(grid[0])
-    unassigned = {(r,c) for r in range(M) for c in range(N) if grid[r][c] == 1 or grid[r][c] == -1}
+def greedy_partition_force_min(grid, min_size=1, max_size=4, attempts_per_cell=50, rng=None):
+    rng = make_rng(rng)
+    N, nbl, cells, free = partition_state(grid)
+    unassigned = RandomAccessSet(cells)
     pieces = []
     while unassigned:
-        seed = random.choice(list(unassigned))
-        target_size = random.randint(min_size, max_size)
-        piece = {seed}
-        frontier = [seed]
-        attempts = 0
-        while len(piece) < target_size and frontier and attempts < attempts_per_cell:
-            cell = random.choice(frontier)
-            nbrs = [n for n in neighbors(cell, M, N) if n in unassigned and n not in piece]
-            if not nbrs:
-                frontier.remove(cell)
-                continue
-            newcell = random.choice(nbrs)
-            piece.add(newcell)
-            frontier.append(newcell)
-            attempts += 1
-        if len(piece) < min_size:
-            merged = False
-            for r,c in list(piece):
-                for n in neighbors((r,c), M, N):
-                    if n in unassigned and n not in piece:
-                        piece.add(n)
-                        if len(piece) >= min_size:
-                            merged = True
-                            break
-                if merged:
-                    break
-        pieces.append(sorted(piece))
-        for c in piece:
-            if c in unassigned:
-                unassigned.remove(c)
+        seed = unassigned.choice(rng)
+        target_size = rng.randint(min_size, max_size)
+        free[seed] = 0
+        piece = grow_piece([seed], target_size, free, nbl, rng, attempts=attempts_per_cell)
+        fill_to_min(piece, min_size, free, nbl)
+        for b in piece:
+            unassigned.remove(b)
+        pieces.append([divmod(b, N) for b in sorted(piece)])
     return pieces
 
-def greedy_partition_balanced(grid, min_size=1, max_size=4):
-    pieces = greedy_partition_basic(grid, min_size, max_size)
+def greedy_partition_balanced(grid, min_size=1, max_size=4, rng=None):
+    """Partición básica y luego fusión de las piezas menores que min_size.
+
+    Las piezas se unen con union-find (unión por tamaño) y la adyacencia entre
+    piezas se calcula una sola vez. Las pequeñas salen de una cola por tamaño,
+    de menor a mayor, y se unen al vecino más pequeño con el que no se pasa de
+    max_size. Si ninguno cabe, se unen al vecino más pequeño igualmente.
+    """
+    pieces = greedy_partition_basic(grid, min_size, max_size, rng=make_rng(rng))
     M, N = len(grid), len(grid[0])
-    cell_map = {}
+    nbl = neighbor_lists(M, N)
+    owner = [-1] * (M * N)
     for idx, piece in enumerate(pieces):
-        for cell in piece:
-            cell_map[cell] = idx
-    changed = True
-    while changed:
-        changed = False
-        for i, piece in enumerate(list(pieces)):
-            if len(piece) < min_size:
-                found = False
-                for r, c in piece:
-                    for n in neighbors((r,c), M, N):
-                        if n in cell_map and cell_map[n] != i:
-                            j = cell_map[n]
-                            pieces[i].extend(pieces[j])
-                            for cell in pieces[j]:
-                                cell_map[cell] = i
-                            pieces[j] = []
-                            found = True
-                            changed = True
-                            break
-                    if found:
-                        break
-    pieces = [p for p in pieces if len(p) > 0]
-    return pieces
+        for r, c in piece:
+            owner[r * N + c] = idx
+    adjacent = [set() for _ in pieces]
+    for b, i in enumerate(owner):
+        if i >= 0:
+            for n in nbl[b]:
+                j = owner[n]
+                if j >= 0 and j != i:
+                    adjacent[i].add(j)
+
+    parent = list(range(len(pieces)))
+    size = [len(piece) for piece in pieces]
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    queue = [(size[i], i) for i in range(len(pieces)) if size[i] < min_size]
+    heapq.heapify(queue)
+    while queue:
+        s, i = heapq.heappop(queue)
+        if parent[i] != i or size[i] != s:
+            continue
+        partners = {find(j) for j in adjacent[i]} - {i}
+        adjacent[i] = partners
+        if not partners:
+            continue
+        fitting = [j for j in partners if size[i] + size[j] <= max_size]
+        j = min(fitting or partners, key=lambda j: (size[j], j))
+        if size[i] < size[j]:
+            i, j = j, i
+        parent[j] = i
+        size[i] += size[j]
+        if len(adjacent[i]) < len(adjacent[j]):
+            adjacent[i], adjacent[j] = adjacent[j], adjacent[i]
+        adjacent[i] |= adjacent[j]
+        adjacent[j] = set()
+        if size[i] < min_size:
+            heapq.heappush(queue, (size[i], i))
+
+    merged = {}
+    for idx, piece in enumerate(pieces):
+        merged.setdefault(find(idx), []).extend(piece)
+    return [sorted(cells) for cells in merged.values()]
+
+def smart_partition(grid, min_size=2, max_size=4, attempts_per_cell=50, rng=None):
+    """Empieza cada pieza en la celda libre con más vecinos libres y la hace
+    crecer hacia el vecino más restringido. Los grados se actualizan al ocupar
+    cada celda, en lugar de recalcularlos recorriendo todo el tablero."""
+    rng = make_rng(rng)
+    N, nbl, cells, free = partition_state(grid)
+    degree = [0] * len(free)
+    for x in cells:
+        degree[x] = sum(free[n] for n in nbl[x])
+    queue = DegreeQueue(cells, degree, free)
+
+    def take(x):
+        free[x] = 0
+        for n in nbl[x]:
+            degree[n] -= 1
+            if free[n]:
+                queue.update(n)
 
-def smart_partition(grid, min_size=2, max_size=4, attempts_per_cell=50):
-    M, N = len(grid), len(grid[0])
-    unassigned = {(r,c) for r in range(M) for c in range(N) if grid[r][c] == 1 or grid[r][c] == -1}
     pieces = []
-    while unassigned:
-        seed = max(unassigned, key=lambda x: sum((nbr in unassigned) for nbr in neighbors(x, M, N)))
-        target_size = (min_size + max_size) // 2
-        piece = {seed}
+    target_size = (min_size + max_size) // 2
+    while True:
+        seed = queue.peek_max()
+        if seed is None:
+            break
+        take(seed)
+        piece = [seed]
         frontier = [seed]
         attempts = 0
         while len(piece) < target_size and frontier and attempts < attempts_per_cell:
-            cell = random.choice(frontier)
-            nbrs = [n for n in neighbors(cell, M, N) if n in unassigned and n not in piece]
+            i = rng.randrange(len(frontier))
+            nbrs = [n for n in nbl[frontier[i]] if free[n]]
             if not nbrs:
-                frontier.remove(cell)
+                frontier[i] = frontier[-1]
+                frontier.pop()
                 continue
-            newcell = min(nbrs, key=lambda x: sum((nbr in unassigned and nbr not in piece) for nbr in neighbors(x, M, N)))
-            piece.add(newcell)
+            newcell = min(nbrs, key=degree.__getitem__)
+            take(newcell)
+            piece.append(newcell)
             frontier.append(newcell)
             attempts += 1
         if len(piece) < min_size:
-            added = True
-            while len(piece) < min_size and added:
-                added = False
-                for r,c in list(piece):
-                    for n in neighbors((r,c), M, N):
-                        if n in unassigned and n not in piece:
-                            piece.add(n)
-                            added = True
-                            if len(piece) >= min_size:
-                                break
-                    if len(piece) >= min_size:
-                        break
-        pieces.append(sorted(piece))
-        for c in piece:
-            if c in unassigned:
-                unassigned.remove(c)
+            before = len(piece)
+            fill_to_min(piece, min_size, free, nbl, repeat=True)
+            for x in piece[before:]:
+                free[x] = 1
+                take(x)
+        pieces.append([divmod(b, N) for b in sorted(piece)])
     return pieces
 
 # =============================
@@ -228,10 +597,62 @@ def generate_variants(piece):
         variants.add(tuple(reflect_piece(current)))
     return [list(v) for v in variants]
 
+# =============================
+# TABLA DE POLIOMINÓS
+# =============================
+# Forma normalizada -> (id canónico, forma canónica, orientaciones fijas).
+# Se enumeran una sola vez todos los poliominós libres hasta
+# POLYOMINO_TABLE_MAX_SIZE, por tamaños y solo cuando se piden; formas más
+# grandes se añaden al vuelo la primera vez que aparecen.
+POLYOMINO_TABLE_MAX_SIZE = 8
+POLYOMINO_TABLE = {}
+_polyomino_levels = [{((0, 0),)}]
+_polyomino_next_id = 0
+_polyomino_lock = threading.Lock()
+
+def _add_polyomino(shape):
+    global _polyomino_next_id
+    orientations = tuple(sorted(tuple(v) for v in generate_variants(shape)))
+    entry = (_polyomino_next_id, orientations[0], orientations)
+    _polyomino_next_id += 1
+    for v in orientations:
+        POLYOMINO_TABLE[v] = entry
+    return entry
+
+def build_polyomino_table(max_size):
+    """Enumera los poliominós fijos de tamaño <= max_size creciendo los del nivel anterior."""
+    with _polyomino_lock:
+        while len(_polyomino_levels) < max_size:
+            grown = set()
+            for shape in _polyomino_levels[-1]:
+                cells = set(shape)
+                for cell in shape:
+                    for dr, dc in [(1,0),(-1,0),(0,1),(0,-1)]:
+                        nb = (cell[0]+dr, cell[1]+dc)
+                        if nb not in cells:
+                            grown.add(normalize_piece(shape + (nb,)))
+            _polyomino_levels.append(grown)
+        for level in _polyomino_levels[:max_size]:
+            for shape in sorted(level):
+                if shape not in POLYOMINO_TABLE:
+                    _add_polyomino(shape)
+
+def polyomino_entry(piece):
+    shape = normalize_piece(piece)
+    entry = POLYOMINO_TABLE.get(shape)
+    if entry is None and len(shape) <= POLYOMINO_TABLE_MAX_SIZE:
+        build_polyomino_table(len(shape))
+        entry = POLYOMINO_TABLE.get(shape)
+    if entry is None:
+        with _polyomino_lock:
+            entry = POLYOMINO_TABLE.get(shape) or _add_polyomino(shape)
+    return entry
+
 def canonical_forms(piece):
-    variants = generate_variants(piece)
-    normalized = [tuple(sorted(v)) for v in variants]
-    return min(normalized)
+    return polyomino_entry(piece)[1]
+
+def fixed_orientations(piece):
+    return polyomino_entry(piece)[2]
 
 def group_identical_pieces(pieces):
     groups_map = {}
@@ -243,41 +664,118 @@ def group_identical_pieces(pieces):
 # =============================
 # SOLUCIONES
 # =============================
+# La caché de colocaciones se limita por bytes, no por entradas: cada entrada es
+# una tupla de masks del tamaño del tablero y en un 100x100 pesa decenas de MB.
+# Las que superan PLACEMENT_CACHE_MAX_ENTRY_BYTES no se guardan.
+PLACEMENT_CACHE_MAX_BYTES = int(os.environ.get('PLACEMENT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+PLACEMENT_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('PLACEMENT_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024))
+
+def bytes_lru_cache(max_bytes, max_entry_bytes):
+    """Como functools.lru_cache para funciones que devuelven tuplas de ints, pero
+    limitada por el tamaño en memoria de los resultados."""
+    def decorator(fn):
+        cache = OrderedDict()
+        lock = threading.Lock()
+        total = 0
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            nonlocal total
+            with lock:
+                hit = cache.get(args)
+                if hit is not None:
+                    cache.move_to_end(args)
+                    return hit[0]
+            result = fn(*args)
+            size = sys.getsizeof(result) + sum(map(sys.getsizeof, result))
+            if size <= min(max_bytes, max_entry_bytes):
+                with lock:
+                    old = cache.pop(args, None)
+                    if old is not None:
+                        total -= old[1]
+                    cache[args] = (result, size)
+                    total += size
+                    while total > max_bytes:
+                        _, (_, evicted) = cache.popitem(last=False)
+                        total -= evicted
+            return result
+
+        def cache_clear():
+            nonlocal total
+            with lock:
+                cache.clear()
+                total = 0
+
+        wrapper.cache_clear = cache_clear
+        wrapper.cache_bytes = lambda: total
+        return wrapper
+    return decorator
+
+@bytes_lru_cache(PLACEMENT_CACHE_MAX_BYTES, PLACEMENT_CACHE_MAX_ENTRY_BYTES)
+def shape_placements(shape, cover_mask, M, N):
+    """Masks de todas las colocaciones (rotaciones, reflexiones y traslaciones)
+    de una forma canónica contenidas en cover_mask, ordenadas por su celda mínima.
+
+    Para cada variante se evalúan todos los desplazamientos a la vez con una
+    ventana deslizante sobre el tablero; el resultado se cachea por
+    (forma, tablero) porque se repite entre resoluciones del mismo puzzle.
+    """
+    cover = mask_to_array(cover_mask, M, N)
+    var_masks, lows, var_ids, offsets = [], [], [], []
+    for var in fixed_orientations(shape):
+        rows = np.array([r for r,c in var])
+        cols = np.array([c for r,c in var])
+        h, w = rows.max() + 1, cols.max() + 1
+        if h > M or w > N:
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(cover, (h, w))
+        fits = windows[:, :, rows, cols].all(axis=2)
+        r_shift, c_shift = np.nonzero(fits)
+        offset = r_shift * N + c_shift
+        var_mask = cells_to_mask(var, N)
+        lows.append(offset + (var_mask & -var_mask).bit_length() - 1)
+        var_ids.append(np.full(len(offset), len(var_masks)))
+        offsets.append(offset)
+        var_masks.append(var_mask)
+    if not var_masks:
+        return ()
+    # Variantes normalizadas distintas nunca dan la misma colocación, así que
+    # basta ordenar por celda mínima sin deduplicar.
+    lows, var_ids, offsets = np.concatenate(lows), np.concatenate(var_ids), np.concatenate(offsets)
+    order = np.lexsort((var_ids, lows))
+    return tuple(var_masks[v] << o for v, o in zip(var_ids[order].tolist(), offsets[order].tolist()))
+
+def piece_placements(piece, cover_mask, M, N):
+    return shape_placements(canonical_forms(piece), cover_mask, M, N)
+
+def placements_to_solution(placements, N):
+    return [frozenset(mask_to_cells(pl, N)) for pl in placements]
+
 def find_solutions_unique(grid, pieces, max_solutions=None):
     M, N = len(grid), len(grid[0])
-    cells_to_cover = {(r,c) for r in range(M) for c in range(N) if grid[r][c] != 0}
+    cells_to_cover = grid_mask(grid)
     solutions = []
 
     groups, _ = group_identical_pieces(pieces)
-    group_counts = [len(g) for g in groups]
-
-    group_placements = []
-    for g in groups:
-        rep_idx = g[0]
-        piece = pieces[rep_idx]
-        rel = normalize_piece(piece)
-        variants = generate_variants(rel)
-        placements_set = set()
-        for var in variants:
-            max_r = max(r for r,c in var)
-            max_c = max(c for r,c in var)
-            for r_shift in range(0, M - max_r):
-                for c_shift in range(0, N - max_c):
-                    shifted = frozenset({(r+r_shift, c+c_shift) for r,c in var})
-                    if shifted <= cells_to_cover:
-                        placements_set.add(shifted)
-        placements = sorted(list(placements_set), key=lambda s: (min(s), len(s)))
-        group_placements.append(placements)
+
+    group_placements = [piece_placements(pieces[g[0]], cells_to_cover, M, N) for g in groups]
 
     n_groups = len(groups)
     solution_by_original = [None] * len(pieces)
+    not_first, not_last = column_masks(M, N)
+    # Piezas por tamaño de los grupos posteriores a cada uno, para la poda por regiones
+    sizes_after = [{} for _ in range(n_groups + 1)]
+    for idx in range(n_groups - 1, -1, -1):
+        sizes_after[idx] = dict(sizes_after[idx + 1])
+        size = len(pieces[groups[idx][0]])
+        sizes_after[idx][size] = sizes_after[idx].get(size, 0) + len(groups[idx])
 
     def backtrack_group(idx_group, covered):
         if max_solutions is not None and len(solutions) >= max_solutions:
             return
         if idx_group >= n_groups:
             if covered == cells_to_cover:
-                solutions.append([frozenset(s) for s in solution_by_original])
+                solutions.append(placements_to_solution(solution_by_original, N))
             return
 
         placements = group_placements[idx_group]
@@ -288,6 +786,7 @@ def find_solutions_unique(grid, pieces, max_solutions=None):
             return
 
         chosen = []
+        size = len(pieces[g[0]])
         def place_in_group(start_idx, placed_count, covered_so_far):
             if max_solutions is not None and len(solutions) >= max_solutions:
                 return
@@ -304,6 +803,12 @@ def find_solutions_unique(grid, pieces, max_solutions=None):
                 pl = placements[p_idx]
                 if pl & covered_so_far:
                     continue
+                left = dict(sizes_after[idx_group + 1])
+                left[size] = left.get(size, 0) + k - placed_count - 1
+                if not regions_feasible(cells_to_cover & ~(covered_so_far | pl),
+                                        dilate(pl, N, not_first, not_last), N, not_first, not_last,
+                                        area_bounds(tuple(left.items()))):
+                    continue
                 chosen.append(pl)
                 place_in_group(p_idx + 1, placed_count + 1, covered_so_far | pl)
                 chosen.pop()
@@ -312,9 +817,534 @@ def find_solutions_unique(grid, pieces, max_solutions=None):
 
         place_in_group(0, 0, covered)
 
-    backtrack_group(0, frozenset())
+    if regions_feasible(cells_to_cover, cells_to_cover, N, not_first, not_last,
+                        area_bounds(tuple(sizes_after[0].items()))):
+        backtrack_group(0, 0)
+    return solutions
+
+# =============================
+# PODA POR REGIONES
+# =============================
+# Tras cada colocación se rellenan sobre el mask (desplazamientos de bits
+# recortados con las columnas del borde) las regiones de celdas libres que
+# tocan la pieza recién puesta, que son las únicas que han podido cambiar. Si
+# el área de alguna no es la suma de ninguna combinación de las piezas que
+# quedan (un hueco más pequeño que todas, o uno de 5 celdas con solo piezas de
+# 3 y 4), la rama no tiene solución y no se sigue bajando. Las áreas imposibles
+# son pocas y pequeñas, así que el relleno se corta en cuanto la región las
+# supera y el coste por nodo queda acotado.
+@functools.lru_cache(maxsize=None)
+def column_masks(M, N):
+    """Masks de las celdas fuera de la primera y fuera de la última columna."""
+    first = sum(1 << (r * N) for r in range(M))
+    full = (1 << (M * N)) - 1
+    return full & ~first, full & ~(first << (N - 1))
+
+def dilate(mask, N, not_first, not_last):
+    """mask más sus vecinas en horizontal y vertical (puede salirse por abajo)."""
+    return mask | ((mask << 1) & not_first) | ((mask >> 1) & not_last) | (mask << N) | (mask >> N)
+
+@functools.lru_cache(maxsize=4096)
+def area_bounds(size_counts):
+    """(sums, limit) para las piezas ((tamaño, cuántas), ...). sums es un
+    bitset con el bit a a 1 si alguna combinación suma a celdas (las copias de
+    un tamaño se agrupan en potencias de dos). limit es el área imposible más
+    grande hasta la mitad del total: por encima, el área de una región es
+    imposible solo si lo es la del resto del tablero, que se comprueba aparte."""
+    sums = 1
+    total = 0
+    for size, count in size_counts:
+        total += size * count
+        chunk = 1
+        while count > 0:
+            take = min(chunk, count)
+            sums |= sums << (size * take)
+            count -= take
+            chunk *= 2
+    gaps = ~sums & ((1 << (total // 2 + 1)) - 1)
+    return sums, gaps.bit_length() - 1 if gaps else 0
+
+def regions_feasible(free, seeds, N, not_first, not_last, bounds):
+    """False si alguna región de free que toca seeds tiene un área imposible.
+    Las regiones de más de limit celdas (ver area_bounds) no se completan."""
+    sums, limit = bounds
+    seeds &= free
+    while seeds and limit:
+        region = seeds & -seeds
+        while True:
+            grown = dilate(region, N, not_first, not_last) & free
+            if grown == region:
+                if not (sums >> region.bit_count()) & 1:
+                    return False
+                break
+            region = grown
+            if region.bit_count() > limit:
+                break
+        seeds &= ~region
+    return True
+
+# =============================
+# SIMETRÍAS DEL TABLERO
+# =============================
+# Si el tablero queda igual al girarlo o reflejarlo, cada solución tiene copias
+# transformadas que también son soluciones. Para no enumerarlas se toma un
+# subgrupo H de esas simetrías y una pieza sin repetir a la que ningún elemento
+# de H deja en la misma colocación, y de esa pieza se conserva una sola
+# colocación por órbita. Cada solución encontrada representa entonces |H|.
+BOARD_TRANSFORMS = (
+    lambda a: a,
+    np.flipud,
+    np.fliplr,
+    lambda a: np.rot90(a, 2),
+    # Solo conservan la forma en tableros cuadrados
+    lambda a: a.T,
+    lambda a: np.rot90(a, 2).T,
+    lambda a: np.rot90(a, 1),
+    lambda a: np.rot90(a, 3),
+)
+
+def board_symmetries(grid):
+    """Simetrías del tablero (bloqueadas, normales y aire incluidas) como
+    permutaciones de bits: la celda del bit b pasa al bit perm[b]."""
+    arr = np.asarray(grid)
+    M, N = arr.shape
+    idx = np.arange(M * N).reshape(M, N)
+    perms = []
+    for transform in BOARD_TRANSFORMS:
+        moved = transform(idx)
+        if moved.shape == (M, N) and np.array_equal(transform(arr), arr):
+            perm = np.empty(M * N, dtype=np.int64)
+            perm[moved.ravel()] = np.arange(M * N)
+            perms.append(perm)
+    return perms
+
+def symmetry_subgroups(perms):
+    """Subgrupos del grupo de simetrías, de mayor a menor. Todos los subgrupos
+    de D4 están generados por dos elementos, así que basta cerrar cada par."""
+    identity = np.arange(len(perms[0]))
+    found = {}
+    for a in perms:
+        for b in perms:
+            elems = {identity.tobytes(): identity}
+            frontier = [identity]
+            while frontier:
+                x = frontier.pop()
+                for gen in (a, b):
+                    y = gen[x]
+                    if y.tobytes() not in elems:
+                        elems[y.tobytes()] = y
+                        frontier.append(y)
+            found[frozenset(elems)] = list(elems.values())
+    return sorted(found.values(), key=len, reverse=True)
+
+def transform_mask(mask, perm):
+    out = 0
+    for b in iter_bits(mask):
+        out |= 1 << int(perm[b])
+    return out
+
+def symmetry_breaking(grid, groups, row_group, row_placement):
+    """(orden de H, grupo restringido, filas de ese grupo que se conservan), o
+    None si el tablero no tiene simetrías aprovechables."""
+    perms = board_symmetries(grid)
+    if len(perms) == 1:
+        return None
+    rows_by_group = {}
+    for i, g_idx in enumerate(row_group):
+        rows_by_group.setdefault(g_idx, []).append(i)
+    # Antes las piezas con más colocaciones: restringirlas poda más el árbol
+    candidates = sorted((g_idx for g_idx, g in enumerate(groups) if len(g) == 1),
+                        key=lambda g_idx: -len(rows_by_group.get(g_idx, ())))
+    for subgroup in symmetry_subgroups(perms):
+        if len(subgroup) == 1:
+            break
+        for g_idx in candidates:
+            row_of = {row_placement[i]: i for i in rows_by_group.get(g_idx, ())}
+            keep, seen = set(), set()
+            for placement in sorted(row_of):
+                if placement in seen:
+                    continue
+                orbit = {transform_mask(placement, perm) for perm in subgroup}
+                if len(orbit) != len(subgroup) or not orbit <= row_of.keys():
+                    break
+                seen |= orbit
+                keep.add(row_of[placement])
+            else:
+                if keep:
+                    return len(subgroup), g_idx, keep
+    return None
+
+# =============================
+# EXACT COVER (Algorithm X)
+# =============================
+# Cada celda libre es una columna que debe cubrirse exactamente una vez. Cada
+# grupo de piezas idénticas es una columna con capacidad igual a su tamaño: solo
+# se cierra (eliminando el resto de colocaciones del grupo) cuando se han
+# colocado todas sus copias. Siempre se ramifica sobre la celda con menos
+# opciones, así que cada solución se genera una única vez aunque haya piezas
+# repetidas.
+def exact_cover_problem(grid, pieces, symmetry=False):
+    """Filas del exact cover: una por colocación de cada grupo de piezas idénticas.
+    Devuelve None si el área de las piezas no coincide con la del tablero.
+
+    Con symmetry se descartan las soluciones que son giros o reflejos de otras
+    (ver SIMETRÍAS DEL TABLERO); symmetry_order dice cuántas representa cada una.
+    """
+    M, N = len(grid), len(grid[0])
+    cover_mask = grid_mask(grid)
+    if sum(len(p) for p in pieces) != cover_mask.bit_count():
+        return None
+    with stage('grouping'):
+        groups, _ = group_identical_pieces(pieces)
+    row_group = []
+    row_placement = []
+    with stage('placements'):
+        for g_idx, g in enumerate(groups):
+            placements = piece_placements(pieces[g[0]], cover_mask, M, N)
+            metric_observe('puzzle_solver_placements_per_group', len(placements))
+            row_group.extend([g_idx] * len(placements))
+            row_placement.extend(placements)
+    symmetry_order = 1
+    if symmetry:
+        with stage('symmetry'):
+            breaking = symmetry_breaking(grid, groups, row_group, row_placement)
+        if breaking is not None:
+            symmetry_order, restricted, keep = breaking
+            rows = [i for i, g_idx in enumerate(row_group) if g_idx != restricted or i in keep]
+            row_group = [row_group[i] for i in rows]
+            row_placement = [row_placement[i] for i in rows]
+    return {
+        'M': M,
+        'N': N,
+        'cover_mask': cover_mask,
+        'n_pieces': len(pieces),
+        'groups': groups,
+        'group_sizes': [len(pieces[g[0]]) for g in groups],
+        'row_group': row_group,
+        'row_placement': row_placement,
+        'symmetry_order': symmetry_order,
+    }
+
+def iter_exact_cover(problem, prefix=(), split_depth=None, branches=None, should_stop=None, stats=None):
+    """Genera las soluciones de una en una como listas de masks (una por pieza
+    original), siempre en el mismo orden para el mismo problema.
+
+    prefix son filas ya elegidas por las que empezar. Con split_depth no se
+    baja más allá de esa profundidad: el camino elegido se añade a branches
+    para resolverlo aparte. should_stop se consulta cada 1024 nodos; si se pasa
+    stats, stats['nodes'] lleva la cuenta de nodos visitados y
+    stats['dead_ends'] la de nodos sin salida.
+    """
+    groups = problem['groups']
+    row_group = problem['row_group']
+    row_placement = problem['row_placement']
+    remaining = [len(g) for g in groups]
+    Y = [list(iter_bits(pl)) for pl in row_placement]
+    N = problem['N']
+    not_first, not_last = column_masks(problem['M'], N)
+    group_sizes = problem['group_sizes']
+    # Piezas que quedan por tamaño y celdas libres, para la poda por regiones
+    sizes_left = {}
+    for g, size in zip(groups, group_sizes):
+        sizes_left[size] = sizes_left.get(size, 0) + len(g)
+    free = problem['cover_mask']
+    halo = [dilate(pl, N, not_first, not_last) for pl in row_placement]
+
+    X = {j: set() for j in iter_bits(problem['cover_mask'])}
+    G = [set() for _ in groups]
+    for i, cols in enumerate(Y):
+        for j in cols:
+            X[j].add(i)
+        G[row_group[i]].add(i)
+
+    def select(r):
+        nonlocal free
+        popped = []
+        for j in Y[r]:
+            for i in X[j]:
+                for k in Y[i]:
+                    if k != j:
+                        X[k].remove(i)
+                G[row_group[i]].remove(i)
+            popped.append(X.pop(j))
+        g = row_group[r]
+        remaining[g] -= 1
+        sizes_left[group_sizes[g]] -= 1
+        free ^= row_placement[r]
+        exhausted = None
+        if remaining[g] == 0:
+            # Grupo completo: retirar el resto de sus colocaciones
+            exhausted = G[g]
+            for i in exhausted:
+                for k in Y[i]:
+                    X[k].remove(i)
+            G[g] = set()
+        return popped, exhausted
+
+    def deselect(r, popped, exhausted):
+        nonlocal free
+        g = row_group[r]
+        if exhausted is not None:
+            for i in exhausted:
+                for k in Y[i]:
+                    X[k].add(i)
+            G[g] = exhausted
+        remaining[g] += 1
+        sizes_left[group_sizes[g]] += 1
+        free ^= row_placement[r]
+        for j in reversed(Y[r]):
+            X[j] = popped.pop()
+            for i in X[j]:
+                for k in Y[i]:
+                    if k != j:
+                        X[k].add(i)
+                G[row_group[i]].add(i)
+
+    chosen = list(prefix)
+    for r in prefix:
+        select(r)
+    nodes = 0
+    dead_ends = 0
+    found = 0
+    stopped = False
+
+    def solution():
+        by_group = [[] for _ in groups]
+        for r in chosen:
+            by_group[row_group[r]].append(row_placement[r])
+        placements = [None] * problem['n_pieces']
+        for g, placed in zip(groups, by_group):
+            placed.sort(key=lambda m: m & -m)
+            for orig_idx, pl in zip(sorted(g), placed):
+                placements[orig_idx] = pl
+        return placements
+
+    def search():
+        nonlocal nodes, dead_ends, found, stopped
+        nodes += 1
+        if nodes % 1024 == 1:
+            if stats is not None:
+                stats['nodes'] = nodes
+            if should_stop is not None and should_stop():
+                stopped = True
+        if stopped:
+            return
+        if not X:
+            if any(remaining):
+                dead_ends += 1
+            else:
+                found += 1
+                yield solution()
+            return
+        if split_depth is not None and len(chosen) >= split_depth:
+            branches.append(tuple(chosen))
+            return
+        # Columna más restringida primero (heurística MRV de Knuth)
+        col = min(X, key=lambda j: len(X[j]))
+        if not X[col]:
+            dead_ends += 1
+            return
+        # Con las piezas de este nodo (incluida la que se va a poner) la poda es
+        # algo más floja pero se calcula una vez por nodo y no por hijo
+        bounds = area_bounds(tuple(sizes_left.items()))
+        for r in sorted(X[col]):
+            if bounds[1] and not regions_feasible(free ^ row_placement[r], halo[r], N, not_first, not_last, bounds):
+                dead_ends += 1
+                continue
+            popped, exhausted = select(r)
+            chosen.append(r)
+            yield from search()
+            chosen.pop()
+            deselect(r, popped, exhausted)
+            if stopped:
+                return
+
+    try:
+        # Las regiones que ya trae el tablero (huecos aislados por bordes o aire)
+        if regions_feasible(free, free, N, not_first, not_last, area_bounds(tuple(sizes_left.items()))):
+            yield from search()
+    finally:
+        if stats is not None:
+            stats['nodes'] = nodes
+            stats['dead_ends'] = dead_ends
+        metric_inc('puzzle_solver_nodes_total', nodes)
+        metric_inc('puzzle_solver_dead_ends_total', dead_ends)
+        metric_inc('puzzle_solver_solutions_total', found)
+
+@timed_stage('search')
+def exact_cover_search(problem, max_solutions=None, prefix=(), split_depth=None,
+                       on_solution=None, should_stop=None, stats=None):
+    """Recorre iter_exact_cover hasta max_solutions. should_stop se consulta
+    además tras cada solución. Devuelve (soluciones, ramas)."""
+    solutions = []
+    branches = []
+    search = iter_exact_cover(problem, prefix, split_depth, branches, should_stop, stats)
+    try:
+        for placements in search:
+            solutions.append(placements)
+            if on_solution is not None:
+                on_solution(placements)
+            if should_stop is not None and should_stop():
+                break
+            if max_solutions is not None and len(solutions) >= max_solutions:
+                break
+    finally:
+        search.close()
+    return solutions, branches
+
+def find_solutions_exact_cover(grid, pieces, max_solutions=None, symmetry=False, stats=None):
+    problem = exact_cover_problem(grid, pieces, symmetry=symmetry)
+    if problem is None:
+        return []
+    if stats is not None:
+        stats['symmetry_order'] = problem['symmetry_order']
+    solutions, _ = exact_cover_search(problem, max_solutions, stats=stats)
+    return [placements_to_solution(s, problem['N']) for s in solutions]
+
+def iter_solutions(grid, pieces, symmetry=False, stats=None):
+    """Como find_solutions_exact_cover, pero calculando cada solución cuando se
+    pide; el orden es siempre el mismo."""
+    problem = exact_cover_problem(grid, pieces, symmetry=symmetry)
+    if problem is None:
+        return
+    if stats is not None:
+        stats['symmetry_order'] = problem['symmetry_order']
+    for placements in iter_exact_cover(problem, stats=stats):
+        yield placements_to_solution(placements, problem['N'])
+
+# =============================
+# BÚSQUEDA PARALELA
+# =============================
+# El árbol se corta en sus primeros niveles (las colocaciones candidatas de la
+# celda más restringida, y las siguientes si hacen falta más ramas) y cada rama
+# se resuelve en un proceso. Los procesos comparten un contador de soluciones y
+# se paran en cuanto entre todos alcanzan max_solutions.
+#
+# Los pools usan forkserver (spawn donde no existe): un fork directo de un
+# worker de Gunicorn con hilos copia los locks tal como estén (métricas,
+# almacenes) y el hijo puede quedarse bloqueado. Cada proceso admite como mucho
+# PROCESS_POOL_SLOTS pools a la vez, entre búsquedas paralelas y lotes; sin
+# hueco libre el trabajo se hace en el propio hilo.
+SOLVER_WORKERS = int(os.environ.get('SOLVER_WORKERS', os.cpu_count() or 1))
+PARALLEL_BRANCHES_PER_WORKER = 4
+PARALLEL_MAX_SPLIT_DEPTH = 3
+PROCESS_POOL_SLOTS = int(os.environ.get('PROCESS_POOL_SLOTS', 1))
+
+_process_pool_slots = threading.BoundedSemaphore(PROCESS_POOL_SLOTS)
+
+def process_context():
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    ctx = multiprocessing.get_context('forkserver')
+    if __name__ != '__main__':
+        # Los hijos salen del servidor con la app ya importada
+        ctx.set_forkserver_preload([__name__])
+    return ctx
+
+@contextlib.contextmanager
+def process_pool(workers, ctx=None, **kwargs):
+    """ProcessPoolExecutor de workers procesos, o None si workers es 1 o no
+    queda hueco. Al salir, también si quien consume los resultados abandona,
+    se cancelan las tareas que aún no han empezado."""
+    if workers <= 1 or not _process_pool_slots.acquire(blocking=False):
+        yield None
+        return
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx or process_context(), **kwargs)
+        try:
+            yield pool
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        _process_pool_slots.release()
+
+_solver_worker = {}
+
+def _init_solver_worker(problem, found, stop):
+    _solver_worker.update(problem=problem, found=found, stop=stop)
+
+def _solve_branch(prefix, budget):
+    found = _solver_worker['found']
+    stop = _solver_worker['stop']
+
+    def on_solution(_):
+        with found.get_lock():
+            found.value += 1
+            if budget is not None and found.value >= budget:
+                stop.set()
+
+    solutions, _ = exact_cover_search(_solver_worker['problem'], budget, prefix=prefix,
+                                      on_solution=on_solution, should_stop=stop.is_set)
     return solutions
 
+def find_solutions_parallel(grid, pieces, max_solutions=None, workers=None, symmetry=False, stats=None):
+    problem = exact_cover_problem(grid, pieces, symmetry=symmetry)
+    if problem is None:
+        return []
+    if stats is not None:
+        stats['symmetry_order'] = problem['symmetry_order']
+    workers = max(1, min(workers or SOLVER_WORKERS, SOLVER_WORKERS))
+
+    solutions, branches = [], [()]
+    for depth in range(1, PARALLEL_MAX_SPLIT_DEPTH + 1):
+        solutions, branches = exact_cover_search(problem, max_solutions, split_depth=depth)
+        if len(branches) >= workers * PARALLEL_BRANCHES_PER_WORKER:
+            break
+
+    budget = None if max_solutions is None else max_solutions - len(solutions)
+    if branches and (budget is None or budget > 0):
+        ctx = process_context()
+        found = ctx.Value('i', 0)
+        stop = ctx.Event()
+        with process_pool(min(workers, len(branches)), ctx, initializer=_init_solver_worker,
+                          initargs=(problem, found, stop)) as pool:
+            if pool is None:
+                for prefix in branches:
+                    branch_solutions, _ = exact_cover_search(problem, budget, prefix=prefix)
+                    solutions.extend(branch_solutions)
+                    if budget is not None:
+                        budget -= len(branch_solutions)
+                        if budget <= 0:
+                            break
+            else:
+                try:
+                    futures = [pool.submit(_solve_branch, prefix, budget) for prefix in branches]
+                    for fut in futures:
+                        solutions.extend(fut.result())
+                finally:
+                    # Si algo falla, que las ramas en marcha no sigan hasta el final
+                    stop.set()
+
+    if max_solutions is not None:
+        solutions = solutions[:max_solutions]
+    return [placements_to_solution(s, problem['N']) for s in solutions]
+
+SOLVER_ENGINES = {
+    'exact_cover': find_solutions_exact_cover,
+    'reference': find_solutions_unique,
+}
+DEFAULT_SOLVER_ENGINE = 'exact_cover'
+
+def find_solutions(grid, pieces, max_solutions=None, engine=DEFAULT_SOLVER_ENGINE,
+                   parallel=False, workers=None, symmetry=False, stats=None):
+    """Con symmetry devuelve una solución por cada clase de soluciones iguales
+    salvo simetría del tablero; stats['symmetry_order'] dice cuántas son."""
+    if engine not in SOLVER_ENGINES:
+        raise ValueError(f"Motor de búsqueda desconocido: {engine}")
+    if engine != 'exact_cover':
+        if parallel:
+            raise ValueError("El modo paralelo solo está disponible con el motor exact_cover")
+        if symmetry:
+            raise ValueError("La reducción por simetría solo está disponible con el motor exact_cover")
+        if stats is not None:
+            stats['symmetry_order'] = 1
+        return SOLVER_ENGINES[engine](grid, pieces, max_solutions=max_solutions)
+    if parallel:
+        return find_solutions_parallel(grid, pieces, max_solutions=max_solutions, workers=workers,
+                                       symmetry=symmetry, stats=stats)
+    return find_solutions_exact_cover(grid, pieces, max_solutions=max_solutions,
+                                      symmetry=symmetry, stats=stats)
+
 # =============================
 # STL GENERATION
 # =============================
@@ -339,205 +1369,1411 @@ def cube_vertices_faces(x0, y0, z0, sx, sy, sz):
     ], dtype=int)
     return v, f
 
-def generate_stl_from_pieces(pieces, cube_size=STL_CUBE_SIZE, height=STL_HEIGHT,
-                            gap_mm=STL_GAP_MM, tolerance_mm=STL_TOL_MM):
-    if not _HAVE_NUMPY_STL:
-        raise RuntimeError("numpy-stl no está instalado.")
+# Esquinas y caras de una caja en el mismo orden que cube_vertices_faces
+BOX_CORNERS = np.array([
+    [0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+    [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1],
+], dtype=bool)
+BOX_FACES = cube_vertices_faces(0, 0, 0, 1, 1, 1)[1]
 
-    verts_all = []
-    faces_all = []
-    vert_offset = 0
-
-    total = len(pieces)
-    cols = 3
-    rows = math.ceil(total / cols)
+def boxes_vertices_faces(boxes):
+    """Vértices y caras de un array de cajas (x0, y0, z0, sx, sy, sz).
 
+    Equivale a llamar a cube_vertices_faces por caja y apilar el resultado,
+    pero todas las cajas se construyen de una vez.
+    """
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 6)
+    lo = boxes[:, :3]
+    hi = lo + boxes[:, 3:]
+    verts = np.where(BOX_CORNERS[None], hi[:, None, :], lo[:, None, :]).reshape(-1, 3)
+    faces = (BOX_FACES[None] + 8 * np.arange(len(boxes))[:, None, None]).reshape(-1, 3)
+    return verts, faces
+
+def piece_boxes(piece, base_x, base_y, z, cube_size, height, tolerance_mm):
+    """Cajas de una pieza: un cubo por celda más los puentes de tolerancia a la
+    derecha, abajo y en las esquinas 2x2, en el orden del bucle celda a celda."""
+    cells = np.array([tuple(cell) for cell in piece], dtype=int).reshape(-1, 2)
+    dr = cells[:, 0] - cells[:, 0].min()
+    dc = cells[:, 1] - cells[:, 1].min()
+    occ = np.zeros((dr.max() + 2, dc.max() + 2), dtype=bool)
+    occ[dr, dc] = True
+    right = occ[dr, dc + 1]
+    down = occ[dr + 1, dc]
+    corner = right & down & occ[dr + 1, dc + 1]
+
+    n = len(cells)
+    x = base_x + dc * cube_size + tolerance_mm/2
+    y = base_y + dr * cube_size + tolerance_mm/2
+    boxes = np.empty((n, 4, 6))
+    boxes[:, :, 2] = z
+    boxes[:, :, 5] = height
+    boxes[:, 0, 0], boxes[:, 0, 1] = x, y
+    boxes[:, 0, 3] = boxes[:, 0, 4] = cube_size - tolerance_mm
+    boxes[:, 1, 0] = base_x + (dc + 1) * cube_size - tolerance_mm/2
+    boxes[:, 1, 1] = y
+    boxes[:, 1, 3], boxes[:, 1, 4] = tolerance_mm, cube_size - tolerance_mm
+    boxes[:, 2, 0] = x
+    boxes[:, 2, 1] = base_y + (dr + 1) * cube_size - tolerance_mm/2
+    boxes[:, 2, 3], boxes[:, 2, 4] = cube_size - tolerance_mm, tolerance_mm
+    boxes[:, 3, 0] = base_x + dc * cube_size + (cube_size - tolerance_mm/2)
+    boxes[:, 3, 1] = base_y + dr * cube_size + (cube_size - tolerance_mm/2)
+    boxes[:, 3, 3] = boxes[:, 3, 4] = tolerance_mm
+    present = np.stack([np.ones(n, dtype=bool), right, down, corner], axis=1)
+    return boxes[present]
+
+def base_boxes(grid, cube_size, border, base_thickness, wall_height):
+    """Cajas de la base: placa, cuatro paredes y un bloque por celda bloqueada."""
+    M, N = len(grid), len(grid[0])
+    width = N * cube_size + 2*border
+    length = M * cube_size + 2*border
+    fixed = [
+        (0, 0, 0, width, length, base_thickness),
+        (0, 0, base_thickness, border, length, wall_height),
+        (width - border, 0, base_thickness, border, length, wall_height),
+        (border, 0, base_thickness, width - 2*border, border, wall_height),
+        (border, length - border, base_thickness, width - 2*border, border, wall_height),
+    ]
+    blocked_r, blocked_c = np.nonzero(np.asarray(grid) == 0)
+    blocks = np.empty((len(blocked_r), 6))
+    blocks[:, 0] = border + blocked_c * cube_size
+    blocks[:, 1] = border + blocked_r * cube_size
+    blocks[:, 2] = base_thickness
+    blocks[:, 3] = blocks[:, 4] = cube_size
+    blocks[:, 5] = wall_height
+    return np.vstack([np.array(fixed, dtype=float), blocks])
+
+def gallery_origins(pieces, cube_size, gap_mm, offset_x=0.0, offset_y=0.0, cols=3):
+    """Origen (x, y) de cada pieza en una galería de cols columnas."""
+    if not pieces:
+        return []
     max_w_cells = max((max(c for r, c in piece) - min(c for r, c in piece) + 1) for piece in pieces)
     max_h_cells = max((max(r for r, c in piece) - min(r for r, c in piece) + 1) for piece in pieces)
-
     stride_x = max_w_cells * cube_size + gap_mm
     stride_y = max_h_cells * cube_size + gap_mm
+    return [(offset_x + (idx % cols) * stride_x, offset_y + (idx // cols) * stride_y)
+            for idx in range(len(pieces))]
 
-    for idx, piece in enumerate(pieces):
-        col = idx % cols
-        row = idx // cols
-        base_x = col * stride_x
-        base_y = row * stride_y
+# =============================
+# PLACAS DE IMPRESIÓN
+# =============================
+# Con layout='packed' la base y las piezas se colocan en placas del tamaño de la
+# cama con un skyline bottom-left: se ordenan de mayor a menor y cada una va a
+# la primera placa donde cabe (girada 90° si así queda más abajo), abriendo
+# placas nuevas cuando hace falta. Las placas se exportan una al lado de otra.
+# layout='grid' es la galería antigua de 3 columnas a la derecha de la base.
+STL_LAYOUT_MODES = ('packed', 'grid')
+DEFAULT_STL_LAYOUT = 'packed'
+PLATE_GAP_MM = 20.0
+
+class Skyline:
+    """Perfil superior de una placa como segmentos [x, y, ancho] de izquierda a
+    derecha. failed guarda los tamaños que ya no caben: la placa solo se llena."""
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.segments = [[0.0, 0.0, width]]
+        self.failed = set()
+
+    def find(self, w, h):
+        """(y + h, x, y) de la posición más baja (y luego más a la izquierda) para
+        un rectángulo w x h, o None si no cabe."""
+        if (w, h) in self.failed:
+            return None
+        segs = self.segments
+        best = None
+        for i, (x, _, _) in enumerate(segs):
+            if x + w > self.width + 1e-9:
+                break
+            y = 0.0
+            j = i
+            covered = x
+            while covered < x + w - 1e-9:
+                y = max(y, segs[j][1])
+                covered = segs[j][0] + segs[j][2]
+                j += 1
+            if y + h <= self.depth + 1e-9 and (best is None or (y + h, x) < best[:2]):
+                best = (y + h, x, y)
+        if best is None:
+            self.failed.add((w, h))
+        return best
+
+    def place(self, x, y, w, h):
+        end = x + w
+        segs = []
+        for sx, sy, sw in self.segments:
+            if sx + sw <= x + 1e-9 or sx >= end - 1e-9:
+                segs.append([sx, sy, sw])
+                continue
+            if sx < x:
+                segs.append([sx, sy, x - sx])
+            if sx + sw > end:
+                segs.append([end, sy, sx + sw - end])
+        segs.append([x, y + h, w])
+        segs.sort()
+        merged = [segs[0]]
+        for seg in segs[1:]:
+            if abs(seg[1] - merged[-1][1]) < 1e-9:
+                merged[-1][2] += seg[2]
+            else:
+                merged.append(seg)
+        self.segments = merged
+
+def pack_plates(sizes, bed_width, bed_depth, gap_mm, rotatable):
+    """Coloca rectángulos (ancho, fondo) en placas de la cama dejando gap_mm
+    entre ellos. Devuelve ([(placa, x, y, girado)] en el orden de sizes, anchos
+    de las placas). Lo que no cabe en una cama vacía va solo en una placa a su
+    medida, que no recibe nada más."""
+    bed = (bed_width + gap_mm, bed_depth + gap_mm)
+    order = sorted(range(len(sizes)), key=lambda i: (-max(sizes[i]), -sizes[i][0] * sizes[i][1]))
+    plates = []
+    open_plates = []
+    placements = [None] * len(sizes)
+    for i in order:
+        w, h = sizes[i][0] + gap_mm, sizes[i][1] + gap_mm
+        options = [(w, h, False), (h, w, True)] if rotatable[i] and w != h else [(w, h, False)]
+        for plate_idx in open_plates:
+            plate = plates[plate_idx]
+            found = [(spot, ow, oh, rot) for ow, oh, rot in options
+                     if (spot := plate.find(ow, oh)) is not None]
+            if found:
+                (_, x, y), ow, oh, rot = min(found, key=lambda f: f[0][:2])
+                plate.place(x, y, ow, oh)
+                placements[i] = (plate_idx, x, y, rot)
+                break
+        else:
+            fitting = [(ow, oh, rot) for ow, oh, rot in options if ow <= bed[0] + 1e-9 and oh <= bed[1] + 1e-9]
+            ow, oh, rot = (fitting or options)[0]
+            plate = Skyline(max(bed[0], ow), max(bed[1], oh))
+            plate.place(0.0, 0.0, ow, oh)
+            placements[i] = (len(plates), 0.0, 0.0, rot)
+            if fitting:
+                open_plates.append(len(plates))
+            plates.append(plate)
+    return placements, [plate.width - gap_mm for plate in plates]
+
+def piece_footprint(shape, cube_size):
+    return ((max(c for r, c in shape) + 1) * cube_size, (max(r for r, c in shape) + 1) * cube_size)
+
+def puzzle_layout(grid, pieces, cube_size=10.0, gap_mm=5.0, border=5.0, layout=DEFAULT_STL_LAYOUT,
+                  bed_width=PRINT_BED_WIDTH_MM, bed_depth=PRINT_BED_DEPTH_MM):
+    """Posición de la base y de cada pieza. Devuelve ((x, y) de la base,
+    [(forma normalizada, ya girada si toca, x, y)] por pieza, nº de placas)."""
+    if layout not in STL_LAYOUT_MODES:
+        raise ValueError(f"Distribución desconocida: {layout}")
+    M, N = len(grid), len(grid[0])
+    base_size = (N * cube_size + 2 * border, M * cube_size + 2 * border)
+    shapes = [normalize_piece(piece) for piece in pieces]
+    if layout == 'grid':
+        origins = gallery_origins(pieces, cube_size, gap_mm, base_size[0] + 20.0, 0.0)
+        return (0.0, 0.0), [(shape, x, y) for shape, (x, y) in zip(shapes, origins)], 1
+
+    sizes = [base_size] + [piece_footprint(shape, cube_size) for shape in shapes]
+    placements, widths = pack_plates(sizes, bed_width, bed_depth, gap_mm, [False] + [True] * len(shapes))
+    plate_x = np.concatenate([[0.0], np.cumsum(np.add(widths, PLATE_GAP_MM))]).tolist()
+
+    def origin(placement):
+        plate_idx, x, y, _ = placement
+        return plate_x[plate_idx] + x, y
+
+    placed = [(rotate_piece(shape) if rot else shape, *origin(pl))
+              for shape, pl in zip(shapes, placements[1:]) for rot in [pl[3]]]
+    return origin(placements[0]), placed, len(widths)
+
+def boxes_to_stl_mesh(boxes):
+    """numpy-stl Mesh con el eje Y invertido, como espera el resto del pipeline."""
+    mesh = optional_module('stl.mesh')
+    verts, faces = boxes_vertices_faces(boxes)
+    stl_mesh = mesh.Mesh(np.zeros(faces.shape[0], dtype=mesh.Mesh.dtype))
+    stl_mesh.vectors[:] = verts[faces]
+    height = verts[:, 1].max()
+    stl_mesh.vectors[:, :, 1] = height - stl_mesh.vectors[:, :, 1]
+    return stl_mesh
 
-        min_r = min(r for r, c in piece)
-        min_c = min(c for r, c in piece)
-        piece_set = set(piece)
+# =============================
+# STL BINARIO EN STREAMING
+# =============================
+# Cabecera de 80 bytes, nº de triángulos (uint32) y un registro de 50 bytes por
+# triángulo. El nº de triángulos y la bounding box se calculan antes de emitir
+# nada, así que el fichero sale por bloques sin tener nunca la malla entera en
+# memoria.
+STL_RECORD_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vectors', '<f4', (3, 3)), ('attr', '<u2')])
+STL_STREAM_CHUNK_BOXES = 2048
+STL_GEOMETRY_MODES = ('boxes', 'merged')
+DEFAULT_STL_GEOMETRY = 'boxes'
+
+def triangle_normals(vectors):
+    normals = np.cross(vectors[:, 1] - vectors[:, 0], vectors[:, 2] - vectors[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)[:, None]
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+BOX_NORMALS = triangle_normals(BOX_CORNERS.astype(float)[BOX_FACES])
+
+def stl_binary_size(n_triangles):
+    return 84 + STL_RECORD_DTYPE.itemsize * n_triangles
+
+def stl_binary_header(n_triangles):
+    return b'puzzle-generator binary STL'.ljust(80, b' ') + np.uint32(n_triangles).tobytes()
+
+def boxes_bounds(boxes):
+    lo = boxes[:, :3]
+    return lo.min(axis=0), (lo + boxes[:, 3:]).max(axis=0)
+
+def iter_box_chunks(boxes, shift, chunk_boxes=STL_STREAM_CHUNK_BOXES):
+    """(normales, triángulos) de las cajas desplazadas -shift, por bloques."""
+    for start in range(0, len(boxes), chunk_boxes):
+        chunk = boxes[start:start + chunk_boxes].copy()
+        chunk[:, :3] -= shift
+        verts, faces = boxes_vertices_faces(chunk)
+        yield np.tile(BOX_NORMALS, (len(chunk), 1)), verts[faces]
+
+def iter_stl_binary(n_triangles, chunks):
+    """Bytes de un STL binario con n_triangles triángulos dados por bloques."""
+    yield stl_binary_header(n_triangles)
+    for normals, vectors in chunks:
+        records = np.zeros(len(vectors), dtype=STL_RECORD_DTYPE)
+        records['normal'] = normals
+        records['vectors'] = vectors
+        yield records.tobytes()
+
+PIECE_MESH_CACHE_SIZE = 1024
+
+@functools.lru_cache(maxsize=PIECE_MESH_CACHE_SIZE)
+def piece_mesh_local(shape, cube_size, height, tolerance_mm, geometry):
+    """Geometría de una forma normalizada con origen en (0, 0, 0): cajas (n, 6)
+    con geometry='boxes' o triángulos (n, 3, 3) con 'merged'. Se cachea por
+    forma y parámetros para reutilizarla entre piezas y entre puzzles."""
+    if geometry == 'merged':
+        arr = merged_piece_triangles(shape, cube_size, height, tolerance_mm)
+    else:
+        arr = piece_boxes(shape, 0.0, 0.0, 0.0, cube_size, height, tolerance_mm)
+    arr.setflags(write=False)
+    return arr
+
+def puzzle_boxes(grid, pieces, cube_size=10.0, height=2.0, gap_mm=5.0, tolerance_mm=0.3, border=5.0, base_thickness=1.0, wall_height=2.0,
+                 layout=DEFAULT_STL_LAYOUT, bed_width=PRINT_BED_WIDTH_MM, bed_depth=PRINT_BED_DEPTH_MM):
+    """Cajas de la base con paredes y de las piezas, distribuidas según layout."""
+    (bx, by), placed, _ = puzzle_layout(grid, pieces, cube_size, gap_mm, border, layout, bed_width, bed_depth)
+    return np.vstack([base_boxes(grid, cube_size, border, base_thickness, wall_height) + (bx, by, 0, 0, 0, 0)] + [
+        piece_mesh_local(shape, cube_size, height, tolerance_mm, 'boxes') + (x, y, base_thickness, 0, 0, 0)
+        for shape, x, y in placed])
+
+@timed_stage('mesh')
+def puzzle_stl_stream(grid, pieces, cube_size=10.0, height=2.0, gap_mm=5.0, tolerance_mm=0.3, border=5.0,
+                      base_thickness=1.0, wall_height=2.0, geometry=DEFAULT_STL_GEOMETRY,
+                      layout=DEFAULT_STL_LAYOUT, bed_width=PRINT_BED_WIDTH_MM, bed_depth=PRINT_BED_DEPTH_MM):
+    """(tamaño en bytes, generador de bytes) del STL del puzzle centrado en el origen.
+
+    geometry='boxes' emite una caja cerrada por celda y por puente; 'merged'
+    emite cada pieza como una única extrusión y la base con bloques fusionados.
+    layout decide dónde van la base y las piezas (ver PLACAS DE IMPRESIÓN).
+    """
+    if geometry == 'boxes':
+        boxes = puzzle_boxes(grid, pieces, cube_size, height, gap_mm, tolerance_mm, border, base_thickness, wall_height,
+                             layout, bed_width, bed_depth)
+        bmin, bmax = boxes_bounds(boxes)
+        shift = (bmin + bmax) / 2.0
+        n_triangles = 12 * len(boxes)
+        chunks = iter_box_chunks(boxes, shift)
+    elif geometry == 'merged':
+        (bx, by), placed, _ = puzzle_layout(grid, pieces, cube_size, gap_mm, border, layout, bed_width, bed_depth)
+        base = merged_base_boxes(grid, cube_size, border, base_thickness, wall_height) + (bx, by, 0, 0, 0, 0)
+        # Triángulos y extremos de cada forma una sola vez; las piezas se trasladan
+        # al emitirlas para no tener la malla entera en memoria
+        local = {}
+        for shape, _, _ in placed:
+            if shape not in local:
+                tris = piece_mesh_local(shape, cube_size, height, tolerance_mm, 'merged')
+                points = tris.reshape(-1, 3)
+                local[shape] = (tris, triangle_normals(tris), points.min(axis=0), points.max(axis=0))
+        offsets = np.array([(x, y, base_thickness) for _, x, y in placed]).reshape(-1, 3)
+        lows = np.array([local[shape][2] for shape, _, _ in placed]).reshape(-1, 3) + offsets
+        highs = np.array([local[shape][3] for shape, _, _ in placed]).reshape(-1, 3) + offsets
+        bmin, bmax = boxes_bounds(base)
+        if len(placed):
+            bmin, bmax = np.minimum(bmin, lows.min(axis=0)), np.maximum(bmax, highs.max(axis=0))
+        shift = (bmin + bmax) / 2.0
+        n_triangles = 12 * len(base) + sum(len(local[shape][0]) for shape, _, _ in placed)
+
+        def merged_chunks():
+            yield from iter_box_chunks(base, shift)
+            for (shape, _, _), offset in zip(placed, offsets):
+                tris, normals, _, _ = local[shape]
+                yield normals, tris + (offset - shift)
+        chunks = merged_chunks()
+    else:
+        raise ValueError(f"Geometría STL desconocida: {geometry}")
+    return stl_binary_size(n_triangles), timed_iter('serialize', iter_stl_binary(n_triangles, chunks))
 
-        for r, c in piece:
-            x = base_x + (c - min_c) * cube_size + tolerance_mm/2
-            y = base_y + (r - min_r) * cube_size + tolerance_mm/2
-            v, f = cube_vertices_faces(x, y, 0, cube_size - tolerance_mm, cube_size - tolerance_mm, height)
-            f += vert_offset
-            verts_all.append(v)
-            faces_all.append(f)
-            vert_offset += v.shape[0]
-
-            if (r, c+1) in piece_set:
-                bx = base_x + (c - min_c + 1) * cube_size - tolerance_mm/2
-                by = base_y + (r - min_r) * cube_size + tolerance_mm/2
-                v, f = cube_vertices_faces(bx, by, 0, tolerance_mm, cube_size - tolerance_mm, height)
-                f += vert_offset
-                verts_all.append(v)
-                faces_all.append(f)
-                vert_offset += v.shape[0]
-            if (r+1, c) in piece_set:
-                bx = base_x + (c - min_c) * cube_size + tolerance_mm/2
-                by = base_y + (r - min_r + 1) * cube_size - tolerance_mm/2
-                v, f = cube_vertices_faces(bx, by, 0, cube_size - tolerance_mm, tolerance_mm, height)
-                f += vert_offset
-                verts_all.append(v)
-                faces_all.append(f)
-                vert_offset += v.shape[0]
-
-            if ((r, c+1) in piece_set and (r+1, c) in piece_set and (r+1, c+1) in piece_set):
-                cx = base_x + (c - min_c) * cube_size + (cube_size - tolerance_mm/2)
-                cy = base_y + (r - min_r) * cube_size + (cube_size - tolerance_mm/2)
-                v, f = cube_vertices_faces(cx, cy, 0, tolerance_mm, tolerance_mm, height)
-                f += vert_offset
-                verts_all.append(v)
-                faces_all.append(f)
-                vert_offset += v.shape[0]
-
-    verts_all = np.vstack(verts_all)
-    faces_all = np.vstack(faces_all)
-
-    total_faces = faces_all.shape[0]
-    puzzle_mesh = mesh.Mesh(np.zeros(total_faces, dtype=mesh.Mesh.dtype))
-    for i, face in enumerate(faces_all):
-        for j in range(3):
-            puzzle_mesh.vectors[i][j] = verts_all[face[j], :]
-
-    height = verts_all[:, 1].max()
-    puzzle_mesh.vectors[:, :, 1] = height - puzzle_mesh.vectors[:, :, 1]
-
-    return puzzle_mesh
+# =============================
+# CACHÉ DE EXPORTACIÓN
+# =============================
+# STL ya generados, indexados por un hash estable del puzzle y de todos los
+# parámetros de exportación. LRU en memoria acotada en bytes y, si se define
+# EXPORT_CACHE_DIR, una copia en disco compartida entre workers, acotada a
+# EXPORT_CACHE_DIR_MAX_BYTES borrando los ficheros usados hace más tiempo. El
+# hash sirve también de ETag para que el navegador pueda reutilizar la descarga.
+# La copia en disco sobrevive a los despliegues: EXPORT_FORMAT_VERSION forma
+# parte del hash y hay que subirla si un cambio altera la geometría exportada.
+EXPORT_FORMAT_VERSION = 1
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+EXPORT_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_ENTRY_BYTES', 16 * 1024 * 1024))
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR')
+EXPORT_CACHE_DIR_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_DIR_MAX_BYTES', 512 * 1024 * 1024))
+EXPORT_FORMATS = ('stl', '3mf')
+
+_export_cache = OrderedDict()
+_export_cache_bytes = 0
+_export_cache_lock = threading.Lock()
+
+def export_cache_key(puzzle_id, ext='stl', **params):
+    """Clave de un fichero exportado. Los puzzle_id generados ya son función de
+    (parámetros, semilla), así que basta con ellos, el formato, la versión de
+    la exportación y sus parámetros."""
+    payload = json.dumps({
+        'version': EXPORT_FORMAT_VERSION,
+        'format': ext,
+        'puzzle': puzzle_id,
+        'params': params,
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _export_cache_path(key, ext):
+    return os.path.join(EXPORT_CACHE_DIR, f'{key}.{ext}')
+
+def export_cache_get(key, ext='stl'):
+    with _export_cache_lock:
+        data = _export_cache.get(key)
+        if data is not None:
+            _export_cache.move_to_end(key)
+            return data
+    if EXPORT_CACHE_DIR:
+        path = _export_cache_path(key, ext)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # La fecha de modificación hace de último uso para prune_export_cache_dir
+            os.utime(path)
+        except OSError:
+            return None
+        export_cache_put(key, data, ext, write_disk=False)
+        return data
+    return None
+
+def prune_export_cache_dir():
+    """Borra los ficheros de EXPORT_CACHE_DIR usados hace más tiempo hasta
+    dejarlo por debajo de EXPORT_CACHE_DIR_MAX_BYTES."""
+    files = []
+    with os.scandir(EXPORT_CACHE_DIR) as entries:
+        for entry in entries:
+            if entry.name.rpartition('.')[2] not in EXPORT_FORMATS:
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= EXPORT_CACHE_DIR_MAX_BYTES:
+            break
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        total -= size
+
+def export_cache_put(key, data, ext='stl', write_disk=True):
+    global _export_cache_bytes
+    if len(data) <= min(EXPORT_CACHE_MAX_BYTES, EXPORT_CACHE_MAX_ENTRY_BYTES):
+        with _export_cache_lock:
+            old = _export_cache.pop(key, None)
+            if old is not None:
+                _export_cache_bytes -= len(old)
+            _export_cache[key] = data
+            _export_cache_bytes += len(data)
+            while _export_cache_bytes > EXPORT_CACHE_MAX_BYTES:
+                _, evicted = _export_cache.popitem(last=False)
+                _export_cache_bytes -= len(evicted)
+    if write_disk and EXPORT_CACHE_DIR:
+        os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=EXPORT_CACHE_DIR, delete=False) as tmp:
+            tmp.write(data)
+        os.replace(tmp.name, _export_cache_path(key, ext))
+        prune_export_cache_dir()
+
+def iter_export_cached(key, chunks, size=None, ext='stl'):
+    """Reenvía los bloques del fichero y, si no es demasiado grande, lo guarda en
+    caché al terminar. Sin size (3MF comprimido) se deja de acumular al pasarse."""
+    if size is not None and size > EXPORT_CACHE_MAX_ENTRY_BYTES:
+        yield from chunks
+        return
+    parts = []
+    total = 0
+    for chunk in chunks:
+        yield chunk
+        if parts is not None:
+            parts.append(chunk)
+            total += len(chunk)
+            if total > EXPORT_CACHE_MAX_ENTRY_BYTES:
+                parts = None
+    if parts is not None:
+        export_cache_put(key, b''.join(parts), ext)
+
+# =============================
+# GEOMETRÍA FUSIONADA
+# =============================
+def greedy_rectangles(occ):
+    """Descompone un array booleano en rectángulos maximales (i0, j0, i1, j1), extremos exclusivos."""
+    occ = np.asarray(occ, dtype=bool)
+    free = occ.copy()
+    rects = []
+    H, W = free.shape
+    for i in range(H):
+        j = 0
+        while j < W:
+            if not free[i, j]:
+                j += 1
+                continue
+            j1 = j
+            while j1 < W and free[i, j1]:
+                j1 += 1
+            i1 = i + 1
+            while i1 < H and free[i1, j:j1].all():
+                i1 += 1
+            free[i:i1, j:j1] = False
+            rects.append((i, j, i1, j1))
+            j = j1
+    return rects
+
+def merged_base_boxes(grid, cube_size, border, base_thickness, wall_height):
+    """Como base_boxes, pero con las celdas bloqueadas fusionadas en rectángulos maximales."""
+    boxes = base_boxes(grid, cube_size, border, base_thickness, wall_height)[:5]
+    blocks = [(border + j0 * cube_size, border + i0 * cube_size, base_thickness,
+               (j1 - j0) * cube_size, (i1 - i0) * cube_size, wall_height)
+              for i0, j0, i1, j1 in greedy_rectangles(np.asarray(grid) == 0)]
+    return np.vstack([boxes, np.array(blocks, dtype=float).reshape(-1, 6)])
+
+def merged_piece_triangles(piece, cube_size, height, tolerance_mm):
+    """Triángulos (n, 3, 3) de una pieza como una sola extrusión cerrada, con
+    origen en la esquina de su bounding box y z entre 0 y height.
+
+    La planta se describe en una retícula comprimida en la que celdas, puentes
+    y rellenos de esquina son celdas unidad. Las tapas se cubren con
+    rectángulos maximales y las paredes se parten en todos los vértices de las
+    tapas, así que la malla no tiene T-junctions y es estanca.
+    """
+    cells = np.array([tuple(cell) for cell in piece], dtype=int).reshape(-1, 2)
+    dr = cells[:, 0] - cells[:, 0].min()
+    dc = cells[:, 1] - cells[:, 1].min()
+    h, w = dr.max() + 1, dc.max() + 1
+    filled = np.zeros((h + 1, w + 1), dtype=bool)
+    filled[dr, dc] = True
+    occ = np.zeros((2*h - 1, 2*w - 1), dtype=bool)
+    occ[2*dr, 2*dc] = True
+    right = filled[dr, dc + 1]
+    down = filled[dr + 1, dc]
+    corner = right & down & filled[dr + 1, dc + 1]
+    occ[2*dr[right], 2*dc[right] + 1] = True
+    occ[2*dr[down] + 1, 2*dc[down]] = True
+    occ[2*dr[corner] + 1, 2*dc[corner] + 1] = True
+
+    # Coordenadas (mm) de las líneas de la retícula: 2k -> k*cube + tol/2, 2k+1 -> (k+1)*cube - tol/2
+    def lines(n):
+        k = np.arange(2 * n)
+        return np.where(k % 2 == 0, (k // 2) * cube_size + tolerance_mm/2, (k // 2 + 1) * cube_size - tolerance_mm/2)
+    ys, xs = lines(h), lines(w)
+
+    rects = greedy_rectangles(occ)
+    vertices = set()
+    for i0, j0, i1, j1 in rects:
+        vertices.update([(i0, j0), (i0, j1), (i1, j0), (i1, j1)])
+
+    caps = []
+    for i0, j0, i1, j1 in rects:
+        # Contorno en sentido antihorario (x = j, y = i) con todos los vértices que caen sobre él
+        sides = [
+            [(i0, j) for j in range(j0, j1) if (i0, j) in vertices],
+            [(i, j1) for i in range(i0, i1) if (i, j1) in vertices],
+            [(i1, j) for j in range(j1, j0, -1) if (i1, j) in vertices],
+            [(i, j0) for i in range(i1, i0, -1) if (i, j0) in vertices],
+        ]
+        loop = [p for side in sides for p in side]
+        pts = [(xs[j], ys[i]) for i, j in loop]
+        # Abanico desde una esquina cuyos dos lados no tengan vértices intermedios; si no hay, desde el centro
+        start = next((sum(len(s) for s in sides[:k]) for k in range(4)
+                      if len(sides[k]) == 1 and len(sides[k - 1]) == 1), None)
+        if start is not None:
+            pts = pts[start:] + pts[:start]
+            caps.extend((pts[0], pts[k], pts[k + 1]) for k in range(1, len(pts) - 1))
+        else:
+            center = ((xs[j0] + xs[j1]) / 2, (ys[i0] + ys[i1]) / 2)
+            caps.extend((center, pts[k], pts[(k + 1) % len(pts)]) for k in range(len(pts)))
+
+    caps = np.array(caps, dtype=float).reshape(-1, 3, 2)
+    top = np.concatenate([caps, np.full(caps.shape[:2] + (1,), float(height))], axis=2)
+    bottom = np.concatenate([caps[:, ::-1], np.zeros(caps.shape[:2] + (1,))], axis=2)
+
+    walls = []
+    H, W = occ.shape
+    padded = np.zeros((H + 2, W + 2), dtype=bool)
+    padded[1:-1, 1:-1] = occ
+
+    def add_wall(p, q):
+        (x0, y0), (x1, y1) = p, q
+        walls.append(((x0, y0, 0.0), (x1, y1, 0.0), (x1, y1, height)))
+        walls.append(((x0, y0, 0.0), (x1, y1, height), (x0, y0, height)))
+
+    # Paredes horizontales (línea y = i): sólido en +y -> normal -y -> recorrer x creciente
+    for i in range(H + 1):
+        side = padded[i + 1, 1:-1].astype(int) - padded[i, 1:-1].astype(int)
+        j = 0
+        while j < W:
+            if side[j] == 0:
+                j += 1
+                continue
+            j_end = j + 1
+            while j_end < W and side[j_end] == side[j] and (i, j_end) not in vertices:
+                j_end += 1
+            a, b = (xs[j], ys[i]), (xs[j_end], ys[i])
+            add_wall(a, b) if side[j] > 0 else add_wall(b, a)
+            j = j_end
+    # Paredes verticales (línea x = j): sólido en +x -> normal -x -> recorrer y decreciente
+    for j in range(W + 1):
+        side = padded[1:-1, j + 1].astype(int) - padded[1:-1, j].astype(int)
+        i = 0
+        while i < H:
+            if side[i] == 0:
+                i += 1
+                continue
+            i_end = i + 1
+            while i_end < H and side[i_end] == side[i] and (i_end, j) not in vertices:
+                i_end += 1
+            a, b = (xs[j], ys[i]), (xs[j], ys[i_end])
+            add_wall(b, a) if side[i] > 0 else add_wall(a, b)
+            i = i_end
+
+    walls = np.array(walls, dtype=float).reshape(-1, 3, 3)
+    return np.concatenate([top, bottom, walls])
+
+def generate_stl_from_pieces(pieces, cube_size=STL_CUBE_SIZE, height=STL_HEIGHT,
+                            gap_mm=STL_GAP_MM, tolerance_mm=STL_TOL_MM, layout=DEFAULT_STL_LAYOUT,
+                            bed_width=PRINT_BED_WIDTH_MM, bed_depth=PRINT_BED_DEPTH_MM):
+    """Solo las piezas: en galería con layout='grid' o en placas de la cama con 'packed'."""
+    if optional_module('stl.mesh') is None:
+        raise RuntimeError("numpy-stl no está instalado.")
+    if layout not in STL_LAYOUT_MODES:
+        raise ValueError(f"Distribución desconocida: {layout}")
+
+    if layout == 'grid':
+        origins = gallery_origins(pieces, cube_size, gap_mm)
+        boxes = np.vstack([piece_boxes(piece, base_x, base_y, 0, cube_size, height, tolerance_mm)
+                           for piece, (base_x, base_y) in zip(pieces, origins)])
+        return boxes_to_stl_mesh(boxes)
+
+    shapes = [normalize_piece(piece) for piece in pieces]
+    placements, widths = pack_plates([piece_footprint(shape, cube_size) for shape in shapes],
+                                     bed_width, bed_depth, gap_mm, [True] * len(shapes))
+    plate_x = np.concatenate([[0.0], np.cumsum(np.add(widths, PLATE_GAP_MM))])
+    boxes = np.vstack([piece_boxes(rotate_piece(shape) if rot else shape, plate_x[plate] + x, y, 0,
+                                   cube_size, height, tolerance_mm)
+                       for shape, (plate, x, y, rot) in zip(shapes, placements)])
+    return boxes_to_stl_mesh(boxes)
 
 def generate_base_scene(grid, cube_size=STL_CUBE_SIZE, border=5.0, base_thickness=3.0, wall_height=5.0):
     """Genera una escena trimesh con la base (placa + paredes)."""
-    if not _HAVE_TRIMESH:
+    trimesh = optional_module('trimesh')
+    if trimesh is None:
         raise RuntimeError("trimesh no está instalado.")
 
-    import trimesh
-    from trimesh import Scene
-    
-    M, N = len(grid), len(grid[0])
-    base_width = N * cube_size + 2 * border
-    base_length = M * cube_size + 2 * border
-
-    verts_all = []
-    faces_all = []
-    vert_offset = 0
-
-    # Base (placa inferior)
-    v, f = cube_vertices_faces(0, 0, 0, base_width, base_length, base_thickness)
-    f += vert_offset
-    verts_all.append(v)
-    faces_all.append(f)
-    vert_offset += v.shape[0]
-
-    # Paredes perimetrales completas (cubren esquinas)
-    # Izquierda
-    v, f = cube_vertices_faces(0, 0, base_thickness, border, base_length, wall_height)
-    f += vert_offset
-    verts_all.append(v)
-    faces_all.append(f)
-    vert_offset += v.shape[0]
-
-    # Derecha
-    v, f = cube_vertices_faces(base_width - border, 0, base_thickness, border, base_length, wall_height)
-    f += vert_offset
-    verts_all.append(v)
-    faces_all.append(f)
-    vert_offset += v.shape[0]
-
-    # Frontal
-    v, f = cube_vertices_faces(border, 0, base_thickness, base_width - 2 * border, border, wall_height)
-    f += vert_offset
-    verts_all.append(v)
-    faces_all.append(f)
-    vert_offset += v.shape[0]
-
-    # Trasera
-    v, f = cube_vertices_faces(border, base_length - border, base_thickness, base_width - 2 * border, border, wall_height)
-    f += vert_offset
-    verts_all.append(v)
-    faces_all.append(f)
-    vert_offset += v.shape[0]
-
-    # Bloques internos rellenos según grid (celdas bloqueadas = 0)
-    for r in range(M):
-        for c in range(N):
-            if grid[r][c] == 0:
-                x = border + c * cube_size
-                y = border + r * cube_size
-                z = base_thickness
-                v, f = cube_vertices_faces(x, y, z, cube_size, cube_size, wall_height)
-                f += vert_offset
-                verts_all.append(v)
-                faces_all.append(f)
-                vert_offset += v.shape[0]
-
-    verts = np.vstack(verts_all)
-    faces = np.vstack(faces_all)
-    
+    verts, faces = boxes_vertices_faces(base_boxes(grid, cube_size, border, base_thickness, wall_height))
+
     base_mesh = trimesh.Trimesh(vertices=verts, faces=faces)
     base_mesh.name = 'Base'
-    
-    scene = Scene([base_mesh])
+
+    scene = trimesh.Scene([base_mesh])
     return scene
 
 def generate_stl_base(grid, cube_size=STL_CUBE_SIZE, border=5.0, base_thickness=3.0, wall_height=5.0):
-    if not _HAVE_NUMPY_STL:
+    if optional_module('stl.mesh') is None:
         raise RuntimeError("numpy-stl no está instalado.")
 
-    M, N = len(grid), len(grid[0])
+    return boxes_to_stl_mesh(base_boxes(grid, cube_size, border, base_thickness, wall_height))
+
+# =============================
+# 3MF CON INSTANCIAS
+# =============================
+# Un 3MF es un zip con el modelo en XML. Cada forma de pieza distinta (con su
+# orientación, es decir, igual salvo traslación) se escribe una sola vez como
+# objeto de malla y cada copia es un item del build con su traslación, así que
+# con piezas repetidas el fichero y el tiempo de exportación bajan en la misma
+# proporción. La base es un objeto más. El zip sale en streaming.
+THREEMF_NS = 'http://schemas.microsoft.com/3dmanufacturing/core/2015/02'
+THREEMF_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+    '</Types>'
+)
+THREEMF_RELS = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Target="/3D/3dmodel.model" Id="rel0" '
+    'Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+    '</Relationships>'
+)
+THREEMF_CHUNK_BYTES = 256 * 1024
+
+def indexed_mesh(geometry_array, geometry):
+    """(vértices, triángulos por índice) de cajas (n, 6) o triángulos (n, 3, 3)."""
+    if geometry == 'merged':
+        verts, tris = np.unique(geometry_array.reshape(-1, 3), axis=0, return_inverse=True)
+        return verts, tris.reshape(-1, 3)
+    return boxes_vertices_faces(geometry_array)
+
+def mesh_object_xml(object_id, name, verts, tris):
+    parts = [f'<object id="{object_id}" name="{name}" type="model"><mesh><vertices>']
+    parts.extend('<vertex x="%.4f" y="%.4f" z="%.4f"/>' % tuple(v) for v in verts.tolist())
+    parts.append('</vertices><triangles>')
+    parts.extend('<triangle v1="%d" v2="%d" v3="%d"/>' % tuple(t) for t in tris.tolist())
+    parts.append('</triangles></mesh></object>')
+    return ''.join(parts)
+
+@timed_stage('mesh')
+def puzzle_3mf_stream(grid, pieces, cube_size=10.0, height=2.0, gap_mm=5.0, tolerance_mm=0.3, border=5.0,
+                      base_thickness=1.0, wall_height=2.0, geometry=DEFAULT_STL_GEOMETRY,
+                      layout=DEFAULT_STL_LAYOUT, bed_width=PRINT_BED_WIDTH_MM, bed_depth=PRINT_BED_DEPTH_MM):
+    """Generador de bytes del 3MF del puzzle, con la misma disposición que el STL
+    (centrado en el origen)."""
+    if geometry not in STL_GEOMETRY_MODES:
+        raise ValueError(f"Geometría STL desconocida: {geometry}")
+    (bx, by), placed_shapes, _ = puzzle_layout(grid, pieces, cube_size, gap_mm, border, layout, bed_width, bed_depth)
+    if geometry == 'merged':
+        base = merged_base_boxes(grid, cube_size, border, base_thickness, wall_height)
+    else:
+        base = base_boxes(grid, cube_size, border, base_thickness, wall_height)
+    base = base + (bx, by, 0, 0, 0, 0)
+
+    # Una malla por forma normalizada (y girada); las piezas guardan (forma, origen)
+    shapes = {}
+    placed = []
+    for shape, x, y in placed_shapes:
+        if shape not in shapes:
+            local = piece_mesh_local(shape, cube_size, height, tolerance_mm, geometry)
+            shapes[shape] = indexed_mesh(local, geometry)
+        placed.append((shape, np.array([x, y, base_thickness])))
+
+    bmin, bmax = boxes_bounds(base)
+    for shape, offset in placed:
+        verts = shapes[shape][0]
+        bmin = np.minimum(bmin, verts.min(axis=0) + offset)
+        bmax = np.maximum(bmax, verts.max(axis=0) + offset)
+    shift = (bmin + bmax) / 2.0
+
+    def model_parts():
+        yield (f'<?xml version="1.0" encoding="UTF-8"?>\n<model unit="millimeter" xml:lang="en-US" '
+               f'xmlns="{THREEMF_NS}"><resources>')
+        base_verts, base_tris = boxes_vertices_faces(base)
+        yield mesh_object_xml(1, 'base', base_verts - shift, base_tris)
+        object_ids = {}
+        for shape, (verts, tris) in shapes.items():
+            object_ids[shape] = len(object_ids) + 2
+            yield mesh_object_xml(object_ids[shape], f'pieza_{object_ids[shape] - 1}', verts, tris)
+        yield '</resources><build><item objectid="1"/>'
+        for shape, offset in placed:
+            tx, ty, tz = (offset - shift).tolist()
+            yield f'<item objectid="{object_ids[shape]}" transform="1 0 0 0 1 0 0 0 1 {tx:.4f} {ty:.4f} {tz:.4f}"/>'
+        yield '</build></model>'
+
+    def chunks():
+        buffer = _ChunkBuffer()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('[Content_Types].xml', THREEMF_CONTENT_TYPES)
+            zf.writestr('_rels/.rels', THREEMF_RELS)
+            with zf.open('3D/3dmodel.model', 'w') as model:
+                pending = 0
+                for part in model_parts():
+                    data = part.encode('utf-8')
+                    model.write(data)
+                    pending += len(data)
+                    if pending >= THREEMF_CHUNK_BYTES:
+                        pending = 0
+                        yield buffer.drain()
+        yield buffer.drain()
+
+    return timed_iter('serialize', chunks())
 
-    verts_all = []
-    faces_all = []
-    vert_offset = 0
+# =============================
+# ALMACÉN DE PUZZLES
+# =============================
+# Cada puzzle generado se guarda con un id propio (grid, piezas y soluciones ya
+# calculadas), de modo que usuarios concurrentes no se pisan y las llamadas
+# siguientes pueden caer en cualquier worker. PUZZLE_STORE_URL elige el backend:
+# 'memory' (LRU con TTL dentro del proceso) o 'sqlite:///ruta.db' (compartido
+# entre workers de la misma máquina).
+PUZZLE_STORE_URL = os.environ.get('PUZZLE_STORE_URL', 'memory')
+PUZZLE_STORE_TTL = float(os.environ.get('PUZZLE_STORE_TTL', 6 * 3600))
+PUZZLE_STORE_MAX_ITEMS = int(os.environ.get('PUZZLE_STORE_MAX_ITEMS', 1000))
+
+class MemoryStore:
+    """LRU con caducidad dentro del proceso."""
+
+    def __init__(self, ttl=PUZZLE_STORE_TTL, max_items=PUZZLE_STORE_MAX_ITEMS):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (time.time() + self.ttl, value)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+class SQLiteStore:
+    """Valores JSON en una tabla SQLite; válido para varios workers en la misma máquina."""
+
+    def __init__(self, path, table='puzzles', ttl=PUZZLE_STORE_TTL):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                      '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+
+    def _execute(self, sql, params=()):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def get(self, key):
+        rows = self._execute(f'SELECT value FROM {self.table} WHERE key = ? AND expires >= ?', (key, time.time()))
+        return json.loads(rows[0][0]) if rows else None
+
+    def put(self, key, value):
+        now = time.time()
+        self._execute(f'DELETE FROM {self.table} WHERE expires < ?', (now,))
+        self._execute(f'INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)',
+                      (key, json.dumps(value), now + self.ttl))
+
+def make_store(url, table='puzzles', ttl=PUZZLE_STORE_TTL, max_items=PUZZLE_STORE_MAX_ITEMS):
+    if url == 'memory':
+        return MemoryStore(ttl=ttl, max_items=max_items)
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):], table=table, ttl=ttl)
+    raise ValueError(f"Backend de almacén desconocido: {url}")
+
+PUZZLE_STORE = make_store(PUZZLE_STORE_URL)
+
+def new_puzzle(grid, pieces, solutions=None, puzzle_id=None, **extra):
+    """Guarda un puzzle y devuelve su id (puzzle_key si viene de una semilla).
+    Si ya se conocen todas sus soluciones se pasan en solutions (formato de
+    pack_solution); extra se guarda tal cual (parámetros, semilla...)."""
+    puzzle_id = puzzle_id or uuid.uuid4().hex
+    PUZZLE_STORE.put(puzzle_id, dict(
+        extra,
+        grid=grid_to_json(grid),
+        pieces=[[list(cell) for cell in piece] for piece in pieces],
+        solutions=solutions or [],
+        solutions_complete=solutions is not None,
+    ))
+    return puzzle_id
+
+def load_puzzle(data):
+    puzzle_id = data.get('puzzle_id')
+    return PUZZLE_STORE.get(puzzle_id) if puzzle_id else None
+
+def pack_solution(solution, shape):
+    """Solución compacta para el almacén: el id de pieza de cada celda del
+    tablero (-1 sin pieza) como int8, o int16 si hay más de 127 piezas, en base64."""
+    M, N = shape
+    ids = np.full(M * N, -1, dtype=np.int8 if len(solution) <= 127 else np.int16)
+    for idx, cells in enumerate(solution):
+        ids[[r * N + c for r, c in cells]] = idx
+    return base64.b64encode(ids.tobytes()).decode('ascii')
+
+def pack_solutions(solutions, shape):
+    return [pack_solution(solution, shape) for solution in solutions]
+
+def unpack_solution(packed, shape):
+    """Array MxN de ids de pieza de una solución de pack_solution."""
+    raw = base64.b64decode(packed)
+    M, N = shape
+    dtype = np.int8 if len(raw) == M * N else np.int16
+    return np.frombuffer(raw, dtype=dtype).reshape(M, N)
+
+def solution_pieces(ids):
+    """Celdas [r, c] de cada pieza, en orden, a partir del array de ids."""
+    N = ids.shape[1]
+    flat = ids.ravel()
+    order = np.argsort(flat, kind='stable')[np.count_nonzero(flat < 0):]
+    bounds = np.cumsum(np.bincount(flat[flat >= 0]))[:-1]
+    return [[[int(b // N), int(b % N)] for b in chunk] for chunk in np.split(order, bounds)]
+
+def solutions_to_json(packed, shape):
+    # Los puzzles guardados antes del formato compacto tienen ya las celdas
+    return [item if isinstance(item, list) else solution_pieces(unpack_solution(item, shape))
+            for item in packed]
+
+def solutions_field(symmetry):
+    """Campo del puzzle con las soluciones guardadas: todas, o solo las distintas
+    salvo simetría (cada una vale por symmetry_order)."""
+    return 'distinct_solutions' if symmetry else 'solutions'
+
+def save_solutions(puzzle_id, puzzle, solutions_json, complete, symmetry=False, symmetry_order=1):
+    """Guarda las soluciones junto al puzzle si amplían lo que ya había. Se
+    guardan como mucho SOLUTIONS_CACHE_MAX y, si sobran, ya no cuentan como
+    completas."""
+    field = solutions_field(symmetry)
+    if len(solutions_json) > SOLUTIONS_CACHE_MAX:
+        solutions_json = solutions_json[:SOLUTIONS_CACHE_MAX]
+        complete = False
+    if complete or len(solutions_json) > len(puzzle.get(field, [])):
+        puzzle[field] = solutions_json
+        puzzle[f'{field}_complete'] = complete
+        if symmetry:
+            puzzle['symmetry_order'] = symmetry_order
+        PUZZLE_STORE.put(puzzle_id, puzzle)
 
-    width = N * cube_size + 2*border
-    height = M * cube_size + 2*border
-    v, f = cube_vertices_faces(0, 0, 0, width, height, base_thickness)
-    verts_all.append(v)
-    faces_all.append(f + vert_offset)
-    vert_offset += v.shape[0]
-
-    for x0, y0, sx, sy in [(0, 0, border, height), (width-border, 0, border, height),
-                           (border, 0, width-2*border, border), (border, height-border, width-2*border, border)]:
-        v, f = cube_vertices_faces(x0, y0, base_thickness, sx, sy, wall_height)
-        verts_all.append(v)
-        faces_all.append(f + vert_offset)
-        vert_offset += v.shape[0]
-
-    for r in range(M):
-        for c in range(N):
-            if grid[r][c] == 0:
-                x = border + c*cube_size
-                y = border + r*cube_size
-                z = base_thickness
-                v, f = cube_vertices_faces(x, y, z, cube_size, cube_size, wall_height)
-                verts_all.append(v)
-                faces_all.append(f + vert_offset)
-                vert_offset += v.shape[0]
-
-    verts_all = np.vstack(verts_all)
-    faces_all = np.vstack(faces_all)
-    total_faces = faces_all.shape[0]
-    base_mesh = mesh.Mesh(np.zeros(total_faces, dtype=mesh.Mesh.dtype))
-    for i, face in enumerate(faces_all):
-        for j in range(3):
-            base_mesh.vectors[i][j] = verts_all[face[j], :]
-
-    height = verts_all[:, 1].max()
-    base_mesh.vectors[:, :, 1] = height - base_mesh.vectors[:, :, 1]
-
-    return base_mesh
+# =============================
+# TRABAJOS DE BÚSQUEDA
+# =============================
+# /api/solve_jobs lanza la búsqueda en un pool de hilos acotado y devuelve un
+# id enseguida; el estado (nodos, soluciones encontradas, tiempo) se publica en
+# JOB_STORE cada SOLVE_JOB_PROGRESS_INTERVAL segundos. Con un almacén SQLite el
+# progreso y la cancelación funcionan aunque las peticiones lleguen a otro worker.
+# El estado se consulta por polling: un stream abierto ocuparía un hilo de
+# Gunicorn durante toda la búsqueda. Solo el hilo que ejecuta el trabajo escribe
+# su registro; la cancelación es una marca aparte en JOB_CANCEL_STORE, así que
+# ninguna petición reescribe el estado con una copia leída antes. Cada trabajo guarda como mucho
+# SOLVE_JOB_MAX_SOLUTIONS soluciones (el registro se reescribe en cada
+# publicación); las siguientes se piden por páginas a /api/solutions.
+SOLVE_JOB_WORKERS = int(os.environ.get('SOLVE_JOB_WORKERS', 2))
+SOLVE_JOB_MAX_PENDING = int(os.environ.get('SOLVE_JOB_MAX_PENDING', 16))
+SOLVE_JOB_MAX_SOLUTIONS = int(os.environ.get('SOLVE_JOB_MAX_SOLUTIONS', 1000))
+SOLVE_JOB_PROGRESS_INTERVAL = 0.5
+SOLVE_JOB_FINAL_STATES = ('done', 'cancelled', 'error')
+
+JOB_STORE = make_store(PUZZLE_STORE_URL, table='solve_jobs')
+JOB_CANCEL_STORE = make_store(PUZZLE_STORE_URL, table='solve_job_cancels')
+_solve_job_pool = ThreadPoolExecutor(max_workers=SOLVE_JOB_WORKERS, thread_name_prefix='solve-job')
+_solve_job_cancel = {}
+_solve_job_lock = threading.Lock()
+
+def submit_solve_job(puzzle_id, max_solutions, symmetry=False):
+    with _solve_job_lock:
+        if len(_solve_job_cancel) >= SOLVE_JOB_MAX_PENDING:
+            raise RuntimeError('Demasiadas búsquedas en curso, inténtalo más tarde')
+        job_id = uuid.uuid4().hex
+        _solve_job_cancel[job_id] = threading.Event()
+    JOB_STORE.put(job_id, {
+        'puzzle_id': puzzle_id,
+        'max_solutions': max_solutions,
+        'symmetry': symmetry,
+        'symmetry_order': 1,
+        'status': 'queued',
+        'nodes': 0,
+        'elapsed': 0.0,
+        'solutions': [],
+        'error': None,
+    })
+    _solve_job_pool.submit(run_solve_job, job_id)
+    return job_id
+
+def cancel_solve_job(job_id):
+    job = JOB_STORE.get(job_id)
+    if job is None or job['status'] in SOLVE_JOB_FINAL_STATES:
+        return job
+    JOB_CANCEL_STORE.put(job_id, True)
+    event = _solve_job_cancel.get(job_id)
+    if event is not None:
+        event.set()
+    return JOB_STORE.get(job_id) or job
+
+def run_solve_job(job_id):
+    cancel = _solve_job_cancel[job_id]
+    job = JOB_STORE.get(job_id)
+    start = time.time()
+    stats = {'nodes': 0}
+    found = []
+    symmetry_order = 1
+    shape = None
+    last_flush = start
+
+    def flush(status, error=None):
+        # El registro solo lo escribe este hilo: se parte de la copia propia
+        nonlocal job, last_flush
+        job = dict(job, status=status, nodes=stats['nodes'], elapsed=round(time.time() - start, 3),
+                   solutions=list(found), symmetry_order=symmetry_order, shape=shape, error=error)
+        JOB_STORE.put(job_id, job)
+        last_flush = time.time()
+
+    def cancel_requested():
+        # La marca puede venir de otro worker a través de JOB_CANCEL_STORE
+        if not cancel.is_set() and JOB_CANCEL_STORE.get(job_id):
+            cancel.set()
+        return cancel.is_set()
+
+    def should_stop():
+        if time.time() - last_flush >= SOLVE_JOB_PROGRESS_INTERVAL:
+            flush('running')
+            return cancel_requested()
+        return cancel.is_set()
+
+    try:
+        if cancel_requested():
+            flush('cancelled')
+            return
+        puzzle = PUZZLE_STORE.get(job['puzzle_id'])
+        if puzzle is None:
+            raise ValueError('No puzzle generated')
+        shape = list(np.shape(puzzle['grid']))
+        flush('running')
+        max_solutions = job['max_solutions']
+        problem = exact_cover_problem(puzzle['grid'], puzzle['pieces'], symmetry=job.get('symmetry', False))
+        if problem is not None:
+            symmetry_order = problem['symmetry_order']
+            exact_cover_search(problem, max_solutions, stats=stats, should_stop=should_stop,
+                               on_solution=lambda sol: found.append(
+                                   pack_solution(placements_to_solution(sol, problem['N']), shape)))
+        if cancel_requested():
+            flush('cancelled')
+        else:
+            save_solutions(job['puzzle_id'], puzzle, list(found), len(found) < max_solutions,
+                           symmetry=job.get('symmetry', False), symmetry_order=symmetry_order)
+            flush('done')
+    except Exception as e:
+        flush('error', str(e))
+    finally:
+        with _solve_job_lock:
+            _solve_job_cancel.pop(job_id, None)
+
+def solve_job_view(job_id, job, since=0):
+    """Estado público de un trabajo con las soluciones nuevas a partir de since."""
+    return {
+        'job_id': job_id,
+        'puzzle_id': job['puzzle_id'],
+        'status': job['status'],
+        'nodes': job['nodes'],
+        'elapsed': job['elapsed'],
+        'solutions_count': len(job['solutions']),
+        'symmetry_order': job.get('symmetry_order', 1),
+        'solutions_since': since,
+        'solutions': solutions_to_json(job['solutions'][since:], job.get('shape')),
+        'error': job['error'],
+    }
+
+# =============================
+# PAGINACIÓN DE SOLUCIONES
+# =============================
+# /api/solutions sirve las soluciones por páginas. Las SOLUTIONS_CACHE_MAX
+# primeras se guardan con el puzzle (compactas, ver pack_solution); para las
+# siguientes se mantiene abierto un cursor sobre iter_solutions que continúa
+# donde lo dejó la página anterior, en lugar de repetir la búsqueda desde el
+# principio. Los cursores viven en el proceso y se descartan por LRU.
+SOLUTIONS_PAGE_MAX = 500
+SOLUTIONS_CACHE_MAX = int(os.environ.get('SOLUTIONS_CACHE_MAX', 1000))
+SOLUTION_CURSORS_MAX = int(os.environ.get('SOLUTION_CURSORS_MAX', 32))
+
+_solution_cursors = OrderedDict()
+_solution_cursors_lock = threading.Lock()
+
+class SolutionCursor:
+    """Búsqueda abierta sobre un puzzle; position es cuántas soluciones ha dado."""
+
+    def __init__(self, puzzle, symmetry):
+        self.shape = np.shape(puzzle['grid'])
+        self.stats = {}
+        self.solutions = iter_solutions(puzzle['grid'], puzzle['pieces'], symmetry=symmetry, stats=self.stats)
+        self.position = 0
+        self.done = False
+        self.lock = threading.Lock()
+
+    def take(self, count):
+        packed = [pack_solution(solution, self.shape)
+                  for solution in itertools.islice(self.solutions, count)]
+        self.position += len(packed)
+        self.done = len(packed) < count
+        return packed
+
+    def skip(self, count):
+        skipped = sum(1 for _ in itertools.islice(self.solutions, count))
+        self.position += skipped
+        self.done = skipped < count
+
+def solution_cursor(puzzle_id, puzzle, symmetry):
+    key = (puzzle_id, symmetry)
+    with _solution_cursors_lock:
+        cursor = _solution_cursors.pop(key, None) or SolutionCursor(puzzle, symmetry)
+        _solution_cursors[key] = cursor
+        while len(_solution_cursors) > SOLUTION_CURSORS_MAX:
+            _solution_cursors.popitem(last=False)
+        return cursor
+
+def drop_solution_cursor(puzzle_id, symmetry, cursor):
+    with _solution_cursors_lock:
+        if _solution_cursors.get((puzzle_id, symmetry)) is cursor:
+            del _solution_cursors[(puzzle_id, symmetry)]
+
+def solutions_page(puzzle_id, puzzle, offset, limit, symmetry=False):
+    """Soluciones [offset, offset + limit) en formato de pack_solution, y si con
+    ellas se llega al final (total es entonces el número de soluciones)."""
+    field = solutions_field(symmetry)
+    cached = puzzle.get(field, [])
+    end = offset + limit
+    if puzzle.get(f'{field}_complete') or end <= len(cached):
+        complete = bool(puzzle.get(f'{field}_complete')) and end >= len(cached)
+        return {
+            'solutions': cached[offset:end],
+            'complete': complete,
+            'total': len(cached) if complete else None,
+            'symmetry_order': puzzle.get('symmetry_order', 1) if symmetry else 1,
+        }
+
+    start = max(offset, len(cached))
+    while True:
+        cursor = solution_cursor(puzzle_id, puzzle, symmetry)
+        with cursor.lock:
+            if cursor.position > start:
+                # Ya pasó de aquí (otra petición o páginas hacia atrás): empezar de nuevo
+                drop_solution_cursor(puzzle_id, symmetry, cursor)
+                continue
+            cursor.skip(start - cursor.position)
+            fresh = cursor.take(end - start) if not cursor.done else []
+            done, total = cursor.done, cursor.position
+            symmetry_order = cursor.stats.get('symmetry_order', 1)
+        break
+    if done:
+        drop_solution_cursor(puzzle_id, symmetry, cursor)
+
+    if start == len(cached) and len(cached) < SOLUTIONS_CACHE_MAX:
+        room = SOLUTIONS_CACHE_MAX - len(cached)
+        save_solutions(puzzle_id, puzzle, cached + fresh[:room], done and len(fresh) <= room,
+                       symmetry=symmetry, symmetry_order=symmetry_order)
+    return {
+        'solutions': cached[offset:start] + fresh,
+        'complete': done,
+        'total': total if done else None,
+        'symmetry_order': symmetry_order,
+    }
+
+# =============================
+# GENERACIÓN DE PUZZLES
+# =============================
+@timed_stage('grid')
+def generate_grid(M, N, border_prob, air_prob, rng=None):
+    """Tablero MxN como array int8: 1 celda normal, 0 bloqueada, -1 aire."""
+    gen = make_numpy_rng(rng)
+    grid = np.ones((M, N), dtype=np.int8)
+    edge = np.zeros((M, N), dtype=bool)
+    edge[[0, -1], :] = True
+    edge[:, [0, -1]] = True
+    grid[edge] = np.where(gen.random(np.count_nonzero(edge)) < border_prob, 0, 1)
+
+    # Esquinas con sus dos vecinos bloqueados se bloquean también; se revisan
+    # en orden porque en tableros de 2 de lado una esquina es vecina de otra
+    for r, c in [(0,0),(0,N-1),(M-1,0),(M-1,N-1)]:
+        if grid[r, c] == 1:
+            blocked_neighbors = 0
+            for nr, nc in [(r+1,c),(r,c+1),(r-1,c),(r,c-1)]:
+                if 0 <= nr < M and 0 <= nc < N and grid[nr, nc] == 0:
+                    blocked_neighbors += 1
+            if blocked_neighbors >= 2:
+                grid[r, c] = 0
+
+    if air_prob > 0:
+        grid[(grid == 1) & (gen.random((M, N)) < air_prob)] = -1
+    return grid
+
+@timed_stage('partition')
+def partition_grid(grid, min_size, max_size, mode=DEFAULT_MODE, rng=None):
+    if mode == "Fast (original)":
+        return greedy_partition_basic(grid, min_size, max_size, rng=rng)
+    elif mode == "Force minimum":
+        return greedy_partition_force_min(grid, min_size, max_size, rng=rng)
+    elif mode == "Balanced":
+        return greedy_partition_balanced(grid, min_size, max_size, rng=rng)
+    else:
+        return smart_partition(grid, min_size, max_size, rng=rng)
+
+def generate_puzzle(M=DEFAULT_M, N=DEFAULT_N, min_size=DEFAULT_MIN_PIECE_SIZE, max_size=DEFAULT_MAX_PIECE_SIZE,
+                    mode=DEFAULT_MODE, border_prob=DEFAULT_BORDER_PROB, air_prob=DEFAULT_AIR_PROB, rng=None):
+    """Tablero aleatorio y su partición en piezas, como /api/generate.
+    Con la misma semilla (rng) devuelve siempre el mismo puzzle."""
+    rng = make_rng(rng)
+    grid = generate_grid(M, N, border_prob, air_prob, rng=rng)
+    return grid, partition_grid(grid, min_size, max_size, mode, rng=rng)
+
+# Versión de la salida de los generadores: forma parte de puzzle_key, así que
+# hay que subirla si un cambio hace que una misma semilla dé otro puzzle.
+GENERATOR_VERSION = 4
+
+def puzzle_key(params, seed, unique=False):
+    """Id de un puzzle como función pura de sus parámetros y su semilla."""
+    payload = json.dumps({'version': GENERATOR_VERSION, 'params': params, 'seed': seed, 'unique': unique},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+# =============================
+# PUZZLES DE SOLUCIÓN ÚNICA
+# =============================
+# Se generan particiones hasta dar con una de solución única. El recuento se
+# corta en la segunda solución y el resultado se guarda por (tablero, multiconjunto
+# de formas): dos candidatos con el mismo tablero y las mismas piezas tienen las
+# mismas soluciones, así que los repetidos no se vuelven a resolver.
+UNIQUE_TIME_BUDGET = float(os.environ.get('UNIQUE_TIME_BUDGET', 10.0))
+UNIQUE_MAX_TIME_BUDGET = float(os.environ.get('UNIQUE_MAX_TIME_BUDGET', 60.0))
+UNIQUE_MAX_ATTEMPTS = 1000
+UNIQUENESS_CACHE_URL = os.environ.get('UNIQUENESS_CACHE_URL', PUZZLE_STORE_URL)
+UNIQUENESS_CACHE_TTL = float(os.environ.get('UNIQUENESS_CACHE_TTL', 30 * 24 * 3600))
+UNIQUENESS_CACHE_MAX_ITEMS = 100000
+
+UNIQUENESS_CACHE = make_store(UNIQUENESS_CACHE_URL, table='uniqueness',
+                              ttl=UNIQUENESS_CACHE_TTL, max_items=UNIQUENESS_CACHE_MAX_ITEMS)
+
+def uniqueness_key(grid, pieces):
+    shapes = sorted(canonical_forms(p) for p in pieces)
+    payload = json.dumps([len(grid), len(grid[0]), grid_mask(grid), shapes], separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def count_solutions(grid, pieces, limit=2, should_stop=None, stats=None):
+    """Número de soluciones, sin pasar de limit."""
+    problem = exact_cover_problem(grid, pieces)
+    if problem is None:
+        return 0
+    solutions, _ = exact_cover_search(problem, limit, should_stop=should_stop, stats=stats)
+    return len(solutions)
+
+def generate_unique_puzzle(M=DEFAULT_M, N=DEFAULT_N, min_size=DEFAULT_MIN_PIECE_SIZE,
+                           max_size=DEFAULT_MAX_PIECE_SIZE, mode=DEFAULT_MODE,
+                           border_prob=DEFAULT_BORDER_PROB, air_prob=DEFAULT_AIR_PROB,
+                           time_budget=UNIQUE_TIME_BUDGET, max_attempts=UNIQUE_MAX_ATTEMPTS, rng=None):
+    """Genera candidatos hasta encontrar uno de solución única o agotar el tiempo.
+
+    Los candidatos salen todos del mismo rng, así que con una semilla fija el
+    puzzle encontrado es siempre el mismo. Devuelve ((grid, pieces) o None,
+    estadísticas).
+    """
+    rng = make_rng(rng)
+    start = time.time()
+    deadline = start + time_budget
+    stats = {'attempts': 0, 'rejected': 0, 'cache_hits': 0, 'solver_nodes': 0, 'elapsed': 0.0}
+
+    def out_of_time():
+        return time.time() >= deadline
+
+    found = None
+    while stats['attempts'] < max_attempts and not out_of_time():
+        stats['attempts'] += 1
+        grid, pieces = generate_puzzle(M, N, min_size, max_size, mode, border_prob, air_prob, rng=rng)
+        key = uniqueness_key(grid, pieces)
+        cached = UNIQUENESS_CACHE.get(key)
+        if cached is not None:
+            stats['cache_hits'] += 1
+            count = cached['solutions']
+        else:
+            search = {'nodes': 0}
+            count = count_solutions(grid, pieces, 2, should_stop=out_of_time, stats=search)
+            stats['solver_nodes'] += search['nodes']
+            if count < 2 and out_of_time():
+                # Búsqueda cortada: no sabemos si era única
+                break
+            UNIQUENESS_CACHE.put(key, {'solutions': count})
+        if count == 1:
+            found = (grid, pieces)
+            break
+        stats['rejected'] += 1
+    stats['elapsed'] = round(time.time() - start, 3)
+    return found, stats
+
+# =============================
+# PRODUCCIÓN POR LOTES
+# =============================
+# Un lote es una matriz de parámetros (cada uno un valor o una lista) por un
+# rango de semillas. Cada combinación genera, resuelve y exporta un puzzle en
+# un proceso del pool; los resultados salen en orden como JSONL o como zip con
+# un STL por puzzle. Lo usan /api/batch y batch.py.
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', SOLVER_WORKERS))
+BATCH_MAX_PUZZLES = int(os.environ.get('BATCH_MAX_PUZZLES', 1000))
+BATCH_PARAMS = {
+    'M': (int, DEFAULT_M),
+    'N': (int, DEFAULT_N),
+    'min_size': (int, DEFAULT_MIN_PIECE_SIZE),
+    'max_size': (int, DEFAULT_MAX_PIECE_SIZE),
+    'mode': (str, DEFAULT_MODE),
+    'border_prob': (float, DEFAULT_BORDER_PROB),
+    'air_prob': (float, DEFAULT_AIR_PROB),
+}
+def check_export_params(params):
+    """Valida los parámetros de exportación (API, 3MF y lotes)."""
+    if params['geometry'] not in STL_GEOMETRY_MODES:
+        raise ValueError(f"Geometría STL desconocida: {params['geometry']}")
+    if params['layout'] not in STL_LAYOUT_MODES:
+        raise ValueError(f"Distribución desconocida: {params['layout']}")
+    if params['bed_width'] <= 0 or params['bed_depth'] <= 0:
+        raise ValueError("El tamaño de la cama debe ser positivo")
+    # Sin holgura las líneas de separación de merged_piece_triangles tienen
+    # ancho cero y la malla deja de ser estanca
+    if params['geometry'] == 'merged' and params['tolerance_mm'] <= 0:
+        raise ValueError("La geometría merged necesita una tolerancia positiva")
+
+BATCH_STL_PARAMS = {
+    'cube_size': (float, STL_CUBE_SIZE),
+    'height': (float, STL_HEIGHT),
+    'gap_mm': (float, STL_GAP_MM),
+    'tolerance_mm': (float, STL_TOL_MM),
+    'border': (float, STL_BASE_BORDER_SIZE_MM),
+    'base_thickness': (float, STL_BASE_THICKNESS_MM),
+    'wall_height': (float, STL_BASE_WALL_HEIGHT_MM),
+    'geometry': (str, DEFAULT_STL_GEOMETRY),
+    'layout': (str, DEFAULT_STL_LAYOUT),
+    'bed_width': (float, PRINT_BED_WIDTH_MM),
+    'bed_depth': (float, PRINT_BED_DEPTH_MM),
+}
+
+def batch_tasks(spec):
+    """Expande la especificación de un lote en una lista de tareas.
+
+    spec lleva los parámetros de BATCH_PARAMS (valor o lista de valores),
+    seed_start/seed_count, max_solutions (0 para no resolver), unique para
+    quedarse solo con los puzzles de solución única, stl para exportar y los
+    parámetros de BATCH_STL_PARAMS.
+    """
+    axes = []
+    for name, (cast, default) in BATCH_PARAMS.items():
+        values = spec.get(name, default)
+        values = values if isinstance(values, (list, tuple)) else [values]
+        axes.append([(name, cast(v)) for v in values])
+    seed_start = int(spec.get('seed_start', 0))
+    seed_count = int(spec.get('seed_count', 1))
+    unique = bool(spec.get('unique', False))
+    max_solutions = int(spec.get('max_solutions', 2))
+    if unique and max_solutions < 2:
+        raise ValueError("El filtro de solución única necesita max_solutions >= 2")
+    stl = None
+    if spec.get('stl', False):
+        stl = {name: cast(spec.get(name, default)) for name, (cast, default) in BATCH_STL_PARAMS.items()}
+        check_export_params(stl)
+
+    combos = [dict(combo) for combo in itertools.product(*axes)]
+    total = len(combos) * seed_count
+    if total > BATCH_MAX_PUZZLES:
+        raise ValueError(f"El lote tiene {total} puzzles (máximo {BATCH_MAX_PUZZLES})")
+    tasks = []
+    for params in combos:
+        for seed in range(seed_start, seed_start + seed_count):
+            tasks.append({'index': len(tasks), 'seed': seed, 'params': params,
+                          'max_solutions': max_solutions, 'unique': unique, 'stl': stl})
+    return tasks
+
+def batch_puzzle(task):
+    """Genera, resuelve y exporta un puzzle del lote. Devuelve (registro, stl)."""
+    start = time.time()
+    grid, pieces = generate_puzzle(**task['params'], rng=task['seed'])
+    record = {
+        'index': task['index'],
+        'seed': task['seed'],
+        'params': task['params'],
+        'grid': grid_to_json(grid),
+        'pieces': [[list(cell) for cell in piece] for piece in pieces],
+        'piece_count': len(pieces),
+    }
+    if task['max_solutions'] > 0:
+        solutions = find_solutions(grid, pieces, max_solutions=task['max_solutions'])
+        record['solutions_count'] = len(solutions)
+        record['unique'] = len(solutions) == 1
+    record['accepted'] = not task['unique'] or record['unique']
+    stl = None
+    if task['stl'] is not None and record['accepted']:
+        stl = export_puzzle_to_stl(grid, pieces, **task['stl'])
+        record['stl_file'] = f"puzzle_{task['index']:05d}_seed{task['seed']}.stl"
+        record['stl_bytes'] = len(stl)
+    record['elapsed'] = round(time.time() - start, 4)
+    return record, stl
+
+def run_batch(tasks, workers=None):
+    """Ejecuta las tareas en un pool de procesos (ver process_pool) y devuelve
+    los resultados en orden. Si se deja de consumir el generador, las tareas
+    pendientes se cancelan."""
+    workers = max(1, min(workers or BATCH_WORKERS, BATCH_WORKERS, len(tasks) or 1))
+    with process_pool(workers) as pool:
+        if pool is None:
+            yield from map(batch_puzzle, tasks)
+            return
+        chunksize = max(1, len(tasks) // (workers * 8))
+        yield from pool.map(batch_puzzle, tasks, chunksize=chunksize)
+
+def batch_summary(total, accepted, start):
+    elapsed = time.time() - start
+    return {
+        'puzzles': total,
+        'accepted': accepted,
+        'elapsed': round(elapsed, 3),
+        'puzzles_per_sec': round(total / elapsed, 3) if elapsed > 0 else None,
+    }
+
+class _ChunkBuffer:
+    """Fichero de solo escritura que acumula bytes para irlos sacando por trozos."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_batch_jsonl(results):
+    """Una línea JSON por puzzle aceptado y una línea final con el resumen."""
+    start = time.time()
+    total = accepted = 0
+    for record, _ in results:
+        total += 1
+        if record['accepted']:
+            accepted += 1
+            yield json.dumps(record) + '\n'
+    yield json.dumps({'summary': batch_summary(total, accepted, start)}) + '\n'
+
+def iter_batch_zip(results):
+    """Zip en streaming con un STL por puzzle aceptado, index.jsonl y summary.json."""
+    start = time.time()
+    total = accepted = 0
+    buffer = _ChunkBuffer()
+    index = []
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for record, stl in results:
+            total += 1
+            if not record['accepted']:
+                continue
+            accepted += 1
+            index.append(json.dumps(record))
+            if stl is not None:
+                zf.writestr(record['stl_file'], stl)
+                yield buffer.drain()
+        zf.writestr('index.jsonl', '\n'.join(index) + '\n' if index else '')
+        zf.writestr('summary.json', json.dumps(batch_summary(total, accepted, start)))
+    yield buffer.drain()
 
 # =============================
 # RUTAS
@@ -551,6 +2787,39 @@ def index():
 def health():
     return jsonify({'status': 'ok'}), 200
 
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def start_request_metrics():
+    request_ctx.request_start = time.perf_counter()
+    request_ctx.request_timings = []
+    request_ctx.request_timings_token = _request_timings.set(request_ctx.request_timings)
+    request_ctx.sampler = None
+    if request.args.get('profile') and (PROFILING_ENABLED or app.debug):
+        request_ctx.sampler = StackSampler(threading.get_ident()).start()
+
+@app.after_request
+def finish_request_metrics(response):
+    """Métricas de la petición, Server-Timing en /api/* y, con ?profile=1 (solo
+    con PROFILING_ENABLED o en debug), el perfil en lugar de la respuesta."""
+    if 'request_start' not in request_ctx:
+        return response
+    if request_ctx.sampler is not None:
+        # Las respuestas en streaming se generan aquí para que entren en el perfil
+        response.get_data()
+        request_ctx.sampler.stop()
+        response = Response(request_ctx.sampler.report(), mimetype='text/plain')
+    total = time.perf_counter() - request_ctx.request_start
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metric_inc('puzzle_http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    metric_observe('puzzle_http_request_seconds', total, endpoint=endpoint)
+    if SERVER_TIMING and request.path.startswith('/api/'):
+        response.headers['Server-Timing'] = server_timing(request_ctx.request_timings, total)
+    _request_timings.reset(request_ctx.request_timings_token)
+    return response
+
 @app.route('/api/generate', methods=['POST'])
 def api_generate():
     try:
@@ -562,53 +2831,47 @@ def api_generate():
         border_prob = float(data.get('border_prob', DEFAULT_BORDER_PROB))
         air_prob = float(data.get('air_prob', DEFAULT_AIR_PROB))
         mode = data.get('mode', DEFAULT_MODE)
-
-        # Generar grid
-        grid = [[1 for _ in range(N)] for _ in range(M)]
-        for r in range(M):
-            for c in range(N):
-                if r in (0, M-1) or c in (0, N-1):
-                    if random.random() < border_prob:
-                        grid[r][c] = 0
-        
-        corners = [(0,0),(0,N-1),(M-1,0),(M-1,N-1)]
-        for r,c in corners:
-            if grid[r][c] == 1:
-                blocked_neighbors = 0
-                for nr,nc in [(r+1,c),(r,c+1),(r-1,c),(r,c-1)]:
-                    if 0 <= nr < M and 0 <= nc < N and grid[nr][nc] == 0:
-                        blocked_neighbors += 1
-                if blocked_neighbors >= 2:
-                    grid[r][c] = 0
-        
-        for r in range(M):
-            for c in range(N):
-                if grid[r][c] == 1 and random.random() < air_prob:
-                    grid[r][c] = -1
-
-        # Generar piezas
-        if mode == "Fast (original)":
-            pieces = greedy_partition_basic(grid, min_size, max_size)
-        elif mode == "Force minimum":
-            pieces = greedy_partition_force_min(grid, min_size, max_size)
-        elif mode == "Balanced":
-            pieces = greedy_partition_balanced(grid, min_size, max_size)
+        unique = bool(data.get('unique', False))
+        seed = data.get('seed')
+        seed = new_seed() if seed is None else int(seed)
+
+        params = {'M': M, 'N': N, 'min_size': min_size, 'max_size': max_size,
+                  'mode': mode, 'border_prob': border_prob, 'air_prob': air_prob}
+        puzzle_id = puzzle_key(params, seed, unique)
+        # Mismos parámetros y semilla: mismo puzzle, con lo que ya se haya resuelto
+        puzzle = PUZZLE_STORE.get(puzzle_id)
+        if puzzle is not None:
+            grid, pieces = puzzle['grid'], puzzle['pieces']
+            unique_stats = puzzle.get('unique_stats')
+        elif unique:
+            time_budget = min(float(data.get('time_budget', UNIQUE_TIME_BUDGET)), UNIQUE_MAX_TIME_BUDGET)
+            found, unique_stats = generate_unique_puzzle(**params, time_budget=time_budget, rng=seed)
+            if found is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'No se encontró un puzzle de solución única en el tiempo disponible',
+                    'seed': seed,
+                    'unique_stats': unique_stats
+                }), 400
+            grid, pieces = found
+            # La única solución es la propia partición
+            new_puzzle(grid, pieces, solutions=pack_solutions([pieces], np.shape(grid)), puzzle_id=puzzle_id,
+                       params=params, seed=seed, unique_stats=unique_stats)
         else:
-            pieces = smart_partition(grid, min_size, max_size)
+            grid, pieces = generate_puzzle(**params, rng=seed)
+            new_puzzle(grid, pieces, puzzle_id=puzzle_id, params=params, seed=seed)
 
-        # Guardar en sesión
-        app.puzzle_data = {
-            'grid': grid,
-            'pieces': pieces,
-            'solutions': []
-        }
-
-        return jsonify({
+        response = {
             'success': True,
-            'grid': grid,
+            'puzzle_id': puzzle_id,
+            'seed': seed,
+            'grid': grid_to_json(grid),
             'pieces': [[list(cell) for cell in piece] for piece in pieces],
             'piece_count': len(pieces)
-        })
+        }
+        if unique:
+            response['unique_stats'] = unique_stats
+        return jsonify(response)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
@@ -617,163 +2880,218 @@ def api_find_solutions():
     try:
         data = request.json
         max_solutions = int(data.get('max_solutions', 10))
-
-        if not hasattr(app, 'puzzle_data') or not app.puzzle_data:
+        engine = data.get('engine', DEFAULT_SOLVER_ENGINE)
+        parallel = bool(data.get('parallel', False))
+        workers = data.get('workers')
+        workers = int(workers) if workers is not None else None
+        symmetry = bool(data.get('symmetry', False))
+
+        puzzle = load_puzzle(data)
+        if puzzle is None:
             return jsonify({'success': False, 'error': 'No puzzle generated'}), 400
 
-        grid = app.puzzle_data['grid']
-        pieces = app.puzzle_data['pieces']
-
-        solutions = find_solutions_unique(grid, pieces, max_solutions=max_solutions)
-        app.puzzle_data['solutions'] = solutions
+        # Reutilizar soluciones ya calculadas si bastan para esta petición
+        field = solutions_field(symmetry)
+        cached = puzzle.get(field, [])
+        if puzzle.get(f'{field}_complete') or len(cached) >= max_solutions:
+            solutions_count = min(len(cached), max_solutions)
+            symmetry_order = puzzle.get('symmetry_order', 1) if symmetry else 1
+        else:
+            stats = {}
+            solutions = find_solutions(puzzle['grid'], puzzle['pieces'], max_solutions=max_solutions,
+                                       engine=engine, parallel=parallel, workers=workers,
+                                       symmetry=symmetry, stats=stats)
+            symmetry_order = stats.get('symmetry_order', 1)
+            complete = len(solutions) < max_solutions
+            # /api/solutions continúa las guardadas en el orden de iter_solutions,
+            # que los otros motores y el modo paralelo no respetan: de ellos solo
+            # se guardan resultados completos que quepan enteros
+            if (complete and len(solutions) <= SOLUTIONS_CACHE_MAX) or (engine == 'exact_cover' and not parallel):
+                save_solutions(data['puzzle_id'], puzzle, pack_solutions(solutions, np.shape(puzzle['grid'])),
+                               complete, symmetry=symmetry, symmetry_order=symmetry_order)
+            solutions_count = len(solutions)
 
         return jsonify({
             'success': True,
-            'solutions_count': len(solutions)
+            'solutions_count': solutions_count,
+            'symmetry_order': symmetry_order
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
-# (3MF export route removed)
-
-# =============================
-# UNIVERSAL 3MF EXPORT (trimesh)
-# =============================
-# (3MF export removed)
-
-def export_puzzle_to_stl(grid, pieces, cube_size=10.0, height=2.0, gap_mm=5.0, tolerance_mm=0.3, border=5.0, base_thickness=1.0, wall_height=2.0):
-    """Genera un único STL con la base y las piezas, dispuestas igual que en 3MF.
-    Se usa la misma disposición en galería a la derecha de la base.
-    """
-    if not _HAVE_TRIMESH:
-        raise RuntimeError('trimesh no disponible para exportar STL')
-
-    # Base con paredes
-    M, N = len(grid), len(grid[0])
-    base_w = N * cube_size + 2 * border
-    # base_h = M * cube_size + 2 * border  # no necesario para layout
-    base_scene = generate_base_scene(grid, cube_size=cube_size, border=border, base_thickness=base_thickness, wall_height=wall_height)
-    base_mesh = list(base_scene.geometry.values())[0]
-
-    # Piezas en galería
-    piece_meshes = []
-    total = len(pieces)
-    cols = 3
-    rows = math.ceil(total / cols) if total > 0 else 0
-
-    if total > 0:
-        max_w_cells = max((max(c for r, c in piece) - min(c for r, c in piece) + 1) for piece in pieces)
-        max_h_cells = max((max(r for r, c in piece) - min(r for r, c in piece) + 1) for piece in pieces)
-    else:
-        max_w_cells = max_h_cells = 0
-
-    stride_x = max_w_cells * cube_size + gap_mm
-    stride_y = max_h_cells * cube_size + gap_mm
-    gallery_offset_x = base_w + 20.0
-    gallery_offset_y = 0.0
-
-    for idx, piece in enumerate(pieces):
-        col = idx % cols
-        row = idx // cols
-        base_x = gallery_offset_x + col * stride_x
-        base_y = gallery_offset_y + row * stride_y
+@app.route('/api/solutions', methods=['GET'])
+def api_solutions():
+    """Página de soluciones: ?puzzle_id=&offset=&limit=[&symmetry=1][&format=ids].
+    Con format=ids cada solución es la matriz de ids de pieza por celda."""
+    try:
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', 10, type=int)
+        if offset < 0 or not 1 <= limit <= SOLUTIONS_PAGE_MAX:
+            raise ValueError(f"offset debe ser >= 0 y limit estar entre 1 y {SOLUTIONS_PAGE_MAX}")
+        output = request.args.get('format', 'pieces')
+        if output not in ('pieces', 'ids'):
+            raise ValueError(f"Formato de soluciones desconocido: {output}")
+        symmetry = request.args.get('symmetry', '0').lower() in ('1', 'true')
+
+        puzzle = load_puzzle(request.args)
+        if puzzle is None:
+            return jsonify({'success': False, 'error': 'No puzzle generated'}), 400
 
-        min_r = min(cell[0] for cell in piece)
-        min_c = min(cell[1] for cell in piece)
-        piece_set = set(tuple(cell) for cell in piece)
+        page = solutions_page(request.args['puzzle_id'], puzzle, offset, limit, symmetry=symmetry)
+        shape = np.shape(puzzle['grid'])
+        if output == 'ids':
+            solutions = [unpack_solution(item, shape).tolist() for item in page['solutions']]
+        else:
+            solutions = solutions_to_json(page['solutions'], shape)
+        return jsonify({
+            'success': True,
+            'offset': offset,
+            'limit': limit,
+            'solutions': solutions,
+            'complete': page['complete'],
+            'total': page['total'],
+            'symmetry_order': page['symmetry_order']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        piece_verts = []
-        piece_faces = []
-        vert_offset = 0
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """Lote de puzzles: JSONL por defecto, o zip con los STL si format == 'zip'."""
+    try:
+        data = request.json or {}
+        output = data.get('format', 'jsonl')
+        if output not in ('jsonl', 'zip'):
+            raise ValueError(f"Formato de lote desconocido: {output}")
+        if output == 'zip':
+            data = dict(data, stl=True)
+        tasks = batch_tasks(data)
+        workers = data.get('workers')
+        results = run_batch(tasks, int(workers) if workers is not None else None)
+        if output == 'zip':
+            return Response(iter_batch_zip(results), mimetype='application/zip',
+                            headers={'Content-Disposition': 'attachment; filename=puzzles.zip'})
+        return Response(iter_batch_jsonl(results), mimetype='application/x-ndjson')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        for r, c in piece:
-            x = base_x + (c - min_c) * cube_size + tolerance_mm/2
-            y = base_y + (r - min_r) * cube_size + tolerance_mm/2
-            z = base_thickness
-            v, f = cube_vertices_faces(x, y, z, cube_size - tolerance_mm, cube_size - tolerance_mm, height)
-            f = f + vert_offset
-            piece_verts.append(v)
-            piece_faces.append(f)
-            vert_offset += v.shape[0]
-
-            if (r, c+1) in piece_set:
-                bx = base_x + (c - min_c + 1) * cube_size - tolerance_mm/2
-                by = base_y + (r - min_r) * cube_size + tolerance_mm/2
-                v, f = cube_vertices_faces(bx, by, z, tolerance_mm, cube_size - tolerance_mm, height)
-                f = f + vert_offset
-                piece_verts.append(v)
-                piece_faces.append(f)
-                vert_offset += v.shape[0]
-            if (r+1, c) in piece_set:
-                bx = base_x + (c - min_c) * cube_size + tolerance_mm/2
-                by = base_y + (r - min_r + 1) * cube_size - tolerance_mm/2
-                v, f = cube_vertices_faces(bx, by, z, cube_size - tolerance_mm, tolerance_mm, height)
-                f = f + vert_offset
-                piece_verts.append(v)
-                piece_faces.append(f)
-                vert_offset += v.shape[0]
-
-            if ((r, c+1) in piece_set and (r+1, c) in piece_set and (r+1, c+1) in piece_set):
-                cx = base_x + (c - min_c) * cube_size + (cube_size - tolerance_mm/2)
-                cy = base_y + (r - min_r) * cube_size + (cube_size - tolerance_mm/2)
-                v, f = cube_vertices_faces(cx, cy, z, tolerance_mm, tolerance_mm, height)
-                f = f + vert_offset
-                piece_verts.append(v)
-                piece_faces.append(f)
-                vert_offset += v.shape[0]
-
-        if piece_verts and piece_faces:
-            verts = np.vstack(piece_verts)
-            faces = np.vstack(piece_faces)
-            piece_mesh = trimesh.Trimesh(vertices=verts, faces=faces)
-            piece_meshes.append(piece_mesh)
-
-    # Concatenar base + piezas en un solo mesh
-    all_meshes = [base_mesh] + piece_meshes
-    combined = trimesh.util.concatenate(all_meshes)
-    # Centrar el conjunto en el origen (mantiene separaciones relativas)
+@app.route('/api/solve_jobs', methods=['POST'])
+def api_create_solve_job():
     try:
-        bmin, bmax = combined.bounds
-        center = (bmin + bmax) / 2.0
-        combined.apply_translation(-center)
-    except Exception:
-        pass
-    # Exportar STL (ASCII o binario según la versión de Trimesh)
-    stl_bytes = combined.export(file_type='stl')
-    if isinstance(stl_bytes, str):
-        stl_bytes = stl_bytes.encode('utf-8')
-    return stl_bytes
+        data = request.json
+        max_solutions = min(int(data.get('max_solutions', 10)), SOLVE_JOB_MAX_SOLUTIONS)
+        if load_puzzle(data) is None:
+            return jsonify({'success': False, 'error': 'No puzzle generated'}), 400
+        job_id = submit_solve_job(data['puzzle_id'], max_solutions, bool(data.get('symmetry', False)))
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-@app.route('/api/export_stl', methods=['POST'])
+@app.route('/api/solve_jobs/<job_id>', methods=['GET'])
+def api_solve_job_status(job_id):
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    since = request.args.get('since', 0, type=int)
+    return jsonify({'success': True, 'job': solve_job_view(job_id, job, since)})
+
+@app.route('/api/solve_jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_solve_job(job_id):
+    job = cancel_solve_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'status': job['status']})
+
+def export_puzzle_to_stl(grid, pieces, cube_size=10.0, height=2.0, gap_mm=5.0, tolerance_mm=0.3, border=5.0, base_thickness=1.0, wall_height=2.0, geometry=DEFAULT_STL_GEOMETRY,
+                         layout=DEFAULT_STL_LAYOUT, bed_width=PRINT_BED_WIDTH_MM, bed_depth=PRINT_BED_DEPTH_MM):
+    """Genera un único STL binario con la base y las piezas, centrado en el origen.
+    Con layout='packed' van repartidas en placas de la cama, una junto a otra.
+    """
+    _, chunks = puzzle_stl_stream(grid, pieces, cube_size, height, gap_mm, tolerance_mm, border, base_thickness, wall_height, geometry,
+                                  layout, bed_width, bed_depth)
+    return b''.join(chunks)
+
+def export_params(data):
+    """Parámetros de exportación de una petición (comunes a STL y 3MF)."""
+    params = {
+        'cube_size': float(data.get('cube_size', STL_CUBE_SIZE)),
+        'height': float(data.get('height', STL_HEIGHT)),
+        'gap_mm': float(data.get('gap_mm', STL_GAP_MM)),
+        'tolerance_mm': float(data.get('tolerance_mm', STL_TOL_MM)),
+        'border': float(data.get('border', STL_BASE_BORDER_SIZE_MM)),
+        'base_thickness': float(data.get('base_thickness', STL_BASE_THICKNESS_MM)),
+        'wall_height': float(data.get('wall_height', STL_BASE_WALL_HEIGHT_MM)),
+        'geometry': data.get('geometry', DEFAULT_STL_GEOMETRY),
+        'layout': data.get('layout', DEFAULT_STL_LAYOUT),
+        'bed_width': float(data.get('bed_width', PRINT_BED_WIDTH_MM)),
+        'bed_depth': float(data.get('bed_depth', PRINT_BED_DEPTH_MM)),
+    }
+    check_export_params(params)
+    return params
+
+@app.route('/api/export_stl', methods=['GET', 'POST'])
 def api_export_stl():
     try:
-        data = request.get_json()
-        if not hasattr(app, 'puzzle_data') or not app.puzzle_data:
+        data = request.get_json(silent=True) if request.method == 'POST' else request.args
+        data = data or {}
+        puzzle = load_puzzle(data)
+        if puzzle is None:
             return jsonify({'success': False, 'error': 'No puzzle generated'}), 400
-        cube_size = float(data.get('cube_size', STL_CUBE_SIZE))
-        height = float(data.get('height', STL_HEIGHT))
-        gap_mm = float(data.get('gap_mm', STL_GAP_MM))
-        tolerance_mm = float(data.get('tolerance_mm', STL_TOL_MM))
-        border = float(data.get('border', STL_BASE_BORDER_SIZE_MM))
-        base_thickness = float(data.get('base_thickness', STL_BASE_THICKNESS_MM))
-        wall_height = float(data.get('wall_height', STL_BASE_WALL_HEIGHT_MM))
-        grid = app.puzzle_data['grid']
-        pieces = app.puzzle_data['pieces']
-        out_bytes = export_puzzle_to_stl(grid, pieces, cube_size, height, gap_mm, tolerance_mm, border, base_thickness, wall_height)
-        file_bytes = io.BytesIO(out_bytes)
-        file_bytes.seek(0)
-        return send_file(file_bytes, mimetype='model/stl', as_attachment=True, download_name='puzzle_project.stl')
+        params = export_params(data)
+        grid = puzzle['grid']
+        pieces = puzzle['pieces']
+
+        key = export_cache_key(data['puzzle_id'], **params)
+        headers = {
+            'Content-Disposition': 'attachment; filename=puzzle_project.stl',
+            'ETag': f'"{key}"',
+            'Cache-Control': 'no-cache',
+        }
+        if request.if_none_match.contains(key):
+            return Response(status=304, headers=headers)
+
+        cached = export_cache_get(key)
+        if cached is not None:
+            return Response(cached, mimetype='model/stl', headers=headers)
+        size, chunks = puzzle_stl_stream(grid, pieces, **params)
+        headers['Content-Length'] = str(size)
+        return Response(iter_export_cached(key, chunks, size), mimetype='model/stl', headers=headers)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
-# (3MF packaging removed)
+@app.route('/api/export_3mf', methods=['GET', 'POST'])
+def api_export_3mf():
+    """Como /api/export_stl, pero en 3MF con una malla por forma de pieza."""
+    try:
+        data = request.get_json(silent=True) if request.method == 'POST' else request.args
+        data = data or {}
+        puzzle = load_puzzle(data)
+        if puzzle is None:
+            return jsonify({'success': False, 'error': 'No puzzle generated'}), 400
+        params = export_params(data)
+
+        key = export_cache_key(data['puzzle_id'], ext='3mf', **params)
+        headers = {
+            'Content-Disposition': 'attachment; filename=puzzle_project.3mf',
+            'ETag': f'"{key}"',
+            'Cache-Control': 'no-cache',
+        }
+        if request.if_none_match.contains(key):
+            return Response(status=304, headers=headers)
+
+        cached = export_cache_get(key, '3mf')
+        if cached is None:
+            chunks = iter_export_cached(key, puzzle_3mf_stream(puzzle['grid'], puzzle['pieces'], **params), ext='3mf')
+        else:
+            chunks = cached
+        return Response(chunks, mimetype='model/3mf', headers=headers)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
 # (Bambu/Orca project 3MF packaging removed)
 
 # (Model settings config removed)
 
-# (3MF XML model builder removed)
-
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', '').lower() == 'true'
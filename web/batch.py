@@ -0,0 +1,71 @@
+"""Generación de puzzles por lotes desde la línea de comandos.
+
+Ejemplo:
+    python batch.py --M 5 6 --N 6 --mode Balanced Strategic --seeds 0:100 --unique --stl --out catalogo
+
+Escribe catalogo.jsonl (un puzzle por línea) y, con --stl, catalogo.zip con un
+STL por puzzle. Al final imprime el resumen con los puzzles por segundo.
+"""
+import argparse
+import json
+import sys
+import time
+import zipfile
+
+from app import (BATCH_PARAMS, BATCH_STL_PARAMS, STL_GEOMETRY_MODES, STL_LAYOUT_MODES, batch_summary,
+                 batch_tasks, run_batch)
+
+def parse_seeds(text):
+    start, _, end = text.partition(':')
+    if not end:
+        return int(start), 1
+    return int(start), int(end) - int(start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Genera un lote de puzzles (JSONL + zip de STL).')
+    for name, (cast, default) in BATCH_PARAMS.items():
+        parser.add_argument(f'--{name}', type=cast, nargs='+', default=[default])
+    parser.add_argument('--seeds', default='0:10', help='rango de semillas inicio:fin (fin excluido)')
+    parser.add_argument('--max-solutions', type=int, default=2, help='0 para no resolver')
+    parser.add_argument('--unique', action='store_true', help='solo puzzles de solución única')
+    parser.add_argument('--stl', action='store_true', help='exportar un STL por puzzle')
+    for name, (cast, default) in BATCH_STL_PARAMS.items():
+        if name == 'geometry':
+            parser.add_argument('--geometry', choices=STL_GEOMETRY_MODES, default=default)
+        elif name == 'layout':
+            parser.add_argument('--layout', choices=STL_LAYOUT_MODES, default=default)
+        else:
+            parser.add_argument(f'--{name.replace("_", "-")}', dest=name, type=cast, default=default)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default='puzzles', help='prefijo de los ficheros de salida')
+    args = parser.parse_args(argv)
+
+    seed_start, seed_count = parse_seeds(args.seeds)
+    spec = {name: getattr(args, name) for name in BATCH_PARAMS}
+    spec.update({name: getattr(args, name) for name in BATCH_STL_PARAMS})
+    spec.update(seed_start=seed_start, seed_count=seed_count, max_solutions=args.max_solutions,
+                unique=args.unique, stl=args.stl)
+    tasks = batch_tasks(spec)
+
+    start = time.time()
+    total = accepted = 0
+    zf = zipfile.ZipFile(f'{args.out}.zip', 'w', compression=zipfile.ZIP_DEFLATED) if args.stl else None
+    try:
+        with open(f'{args.out}.jsonl', 'w') as jsonl:
+            for record, stl in run_batch(tasks, args.workers):
+                total += 1
+                if not record['accepted']:
+                    continue
+                accepted += 1
+                jsonl.write(json.dumps(record) + '\n')
+                if stl is not None:
+                    zf.writestr(record['stl_file'], stl)
+                print(f'\r{total}/{len(tasks)} puzzles, {accepted} aceptados', end='', file=sys.stderr)
+    finally:
+        if zf is not None:
+            zf.close()
+    print(file=sys.stderr)
+    print(json.dumps(batch_summary(total, accepted, start)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+"""Benchmarks de generación, búsqueda de soluciones y exportación STL.
+
+Uso:
+    python bench.py                         # corpus por defecto, JSON por stdout
+    python bench.py --out base.json         # guardar resultados
+    python bench.py --compare base.json     # comparar con una ejecución anterior
+    python bench.py --make-corpus           # regenerar bench_corpus.json
+    python bench.py --startup-only          # solo el arranque (import de app y /health)
+
+El corpus guarda los tableros y las piezas ya generados, así que las medidas de
+búsqueda y exportación no cambian aunque cambien los generadores. La partición se mide
+regenerando cada entrada desde sus parámetros y su semilla.
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import app
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(HERE, 'bench_corpus.json')
+
+# (M, N, min_size, max_size, mode, border_prob, air_prob, seed)
+CORPUS_SPECS = [
+    (5, 6, 3, 4, 'Balanced', 0.25, 0.0, 1),
+    (5, 6, 3, 4, 'Strategic', 0.25, 0.0, 2),
+    (6, 6, 3, 5, 'Fast (original)', 0.25, 0.0, 3),
+    (6, 8, 3, 4, 'Balanced', 0.25, 0.0, 4),
+    (6, 8, 4, 5, 'Force minimum', 0.5, 0.0, 5),
+    (8, 8, 3, 5, 'Balanced', 0.25, 0.1, 6),
+    (8, 8, 4, 6, 'Strategic', 0.0, 0.0, 7),
+    (8, 10, 3, 4, 'Balanced', 0.25, 0.0, 8),
+    (10, 10, 4, 5, 'Balanced', 0.25, 0.0, 9),
+    (12, 12, 4, 6, 'Force minimum', 0.25, 0.0, 10),
+    (40, 40, 3, 5, 'Balanced', 0.25, 0.05, 11),
+    (100, 100, 3, 5, 'Strategic', 0.25, 0.0, 12),
+]
+# Tableros a partir de este área solo se usan para medir partición y STL
+SOLVE_MAX_CELLS = 200
+# Límites de la búsqueda "todas las soluciones": se corta en un número fijo de
+# nodos (no de segundos) para que el trabajo medido sea el mismo en cada ejecución
+SOLVE_ALL_CAP = 5000
+SOLVE_NODE_BUDGET = 20000
+# Cada medida de tiempo repite el trabajo hasta sumar al menos estos ms
+TIMING_MIN_MS = 50.0
+# Diferencia de calibración por debajo de la cual se considera la misma máquina:
+# dentro de ese margen corregir por velocidad solo añadiría el ruido de la calibración
+CALIBRATION_NOISE = 0.1
+# Métricas en las que un valor mayor es peor, para --compare
+COMPARED_METRICS = ('partition_ms', 'first_ms', 'tenth_ms', 'all_ms', 'nodes', 'build_ms', 'peak_kib',
+                    'import_ms', 'health_ms')
+# Dependencias pesadas que no deben cargarse al importar app
+LAZY_MODULES = ('stl', 'trimesh', 'networkx', 'matplotlib')
+# Se ejecuta en un intérprete nuevo: lo que paga cada worker de Gunicorn en frío
+STARTUP_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/health')
+ready = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'health_ms': (ready - imported) * 1000,
+                  'loaded': [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))
+"""
+
+def calibrate(repeat=5):
+    """ms de una carga fija (Python puro más NumPy), el mínimo de repeat
+    ejecuciones: es lo menos sensible a otros procesos. --compare divide los
+    tiempos por ella para no confundir una máquina más lenta con una regresión."""
+    def work():
+        total = 0
+        for i in range(200000):
+            total += i * i % 7
+        np.sort(np.arange(200000)[::-1])
+        return total
+    times = []
+    with no_gc():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            work()
+            times.append((time.perf_counter() - start) * 1000)
+    return round(min(times), 3)
+
+def make_corpus():
+    entries = []
+    for M, N, min_size, max_size, mode, border_prob, air_prob, seed in CORPUS_SPECS:
+        params = {'M': M, 'N': N, 'min_size': min_size, 'max_size': max_size,
+                  'mode': mode, 'border_prob': border_prob, 'air_prob': air_prob}
+        grid, pieces = app.generate_puzzle(**params, rng=seed)
+        entries.append({
+            'name': f'{M}x{N}-{min_size}-{max_size}-{mode}-s{seed}',
+            'params': params,
+            'seed': seed,
+            'grid': app.grid_to_json(grid),
+            'pieces': [[list(cell) for cell in piece] for piece in pieces],
+        })
+    return {'generator_version': app.GENERATOR_VERSION, 'entries': entries}
+
+def clear_caches():
+    app.shape_placements.cache_clear()
+    app.piece_mesh_local.cache_clear()
+
+@contextlib.contextmanager
+def no_gc():
+    """Sin recolector de basura durante la medida, como timeit: una pasada del
+    recolector multiplica por 4 una medida de pocos ms."""
+    gc.collect()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+def timed(fn, repeat):
+    """ms por ejecución en frío (mínimo de repeat medidas) y el último resultado.
+    Como timeit.autorange, cada medida repite fn hasta sumar TIMING_MIN_MS y
+    promedia: una sola ejecución de pocos ms varía más que cualquier umbral."""
+    times = []
+    for _ in range(repeat):
+        total = 0.0
+        loops = 0
+        with no_gc():
+            while loops == 0 or total < TIMING_MIN_MS:
+                clear_caches()
+                start = time.perf_counter()
+                result = fn()
+                total += (time.perf_counter() - start) * 1000
+                loops += 1
+        times.append(total / loops)
+    return round(min(times), 3), result
+
+def bench_startup(repeat):
+    """Import de app y primera respuesta de /health en un proceso nuevo (mínimo
+    de repeat arranques) y dependencias pesadas que quedan cargadas."""
+    runs = [json.loads(subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=HERE, check=True,
+                                      capture_output=True, text=True).stdout)
+            for _ in range(repeat)]
+    return {
+        'import_ms': round(min(run['import_ms'] for run in runs), 3),
+        'health_ms': round(min(run['health_ms'] for run in runs), 3),
+        'loaded': runs[-1]['loaded'],
+    }
+
+def bench_partition(entry, repeat):
+    ms, _ = timed(lambda: app.generate_puzzle(**entry['params'], rng=entry['seed']), repeat)
+    return {'partition_ms': ms}
+
+def bench_solve(grid, pieces, repeat):
+    """Tiempos hasta la primera, la décima y todas las soluciones (mínimo de
+    repeat medidas, cada una la media de varias búsquedas en frío) y nodos visitados."""
+    runs = []
+    for _ in range(repeat):
+        # Como en timed, búsquedas seguidas hasta sumar TIMING_MIN_MS, promediadas
+        batch = []
+        with no_gc():
+            while sum(run['all_ms'] for run in batch) < TIMING_MIN_MS:
+                batch.append(solve_once(grid, pieces))
+        runs.append({key: None if batch[0][key] is None else sum(run[key] for run in batch) / len(batch)
+                     for key in ('first_ms', 'tenth_ms', 'all_ms')})
+    result = dict(batch[-1])
+    for key in ('first_ms', 'tenth_ms', 'all_ms'):
+        if result[key] is not None:
+            result[key] = round(min(run[key] for run in runs), 3)
+    return result
+
+def solve_once(grid, pieces):
+    clear_caches()
+    stamps = []
+    stats = {'nodes': 0}
+    start = time.perf_counter()
+    problem = app.exact_cover_problem(grid, pieces)
+    app.exact_cover_search(problem, SOLVE_ALL_CAP, stats=stats,
+                           on_solution=lambda _: stamps.append(time.perf_counter()),
+                           should_stop=lambda: stats['nodes'] >= SOLVE_NODE_BUDGET)
+    end = time.perf_counter()
+    ms = lambda t: round((t - start) * 1000, 3)
+    return {
+        'solutions': len(stamps),
+        'complete': len(stamps) < SOLVE_ALL_CAP and stats['nodes'] < SOLVE_NODE_BUDGET,
+        'first_ms': ms(stamps[0]) if stamps else None,
+        'tenth_ms': ms(stamps[9]) if len(stamps) >= 10 else None,
+        'all_ms': ms(end),
+        'nodes': stats['nodes'],
+    }
+
+def bench_stl(grid, pieces, geometry, repeat):
+    def build():
+        size, chunks = app.puzzle_stl_stream(grid, pieces, geometry=geometry)
+        for _ in chunks:
+            pass
+        return size
+    ms, size = timed(build, repeat)
+    clear_caches()
+    tracemalloc.start()
+    build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'build_ms': ms, 'bytes': size, 'peak_kib': round(peak / 1024, 1)}
+
+def bench_3mf(grid, pieces, geometry, repeat):
+    def build():
+        return sum(len(chunk) for chunk in app.puzzle_3mf_stream(grid, pieces, geometry=geometry))
+    ms, size = timed(build, repeat)
+    return {'build_ms': ms, 'bytes': size}
+
+def calibrated(measure):
+    """Resultado de measure() con la calibración media de antes y después. En
+    una máquina compartida la velocidad cambia a rachas durante la ejecución,
+    así que cada entrada se corrige con la suya y no con una global."""
+    before = calibrate()
+    result = measure()
+    result['calibration_ms'] = round((before + calibrate()) / 2, 3)
+    return result
+
+def run(corpus, repeat, engines):
+    """repeat pasadas por todo el corpus, en lugar de repeat medidas seguidas:
+    así el rango de cada tiempo recoge también los cambios de velocidad de la
+    máquina a lo largo de la ejecución."""
+    passes = [[calibrated(lambda: run_entry(entry, 1, engines)) for entry in corpus['entries']]
+              for _ in range(repeat)]
+    return [merge_passes(runs) for runs in zip(*passes)]
+
+def merge_passes(runs):
+    """La entrada de la última pasada con el mínimo de cada tiempo y, en
+    'spread', el máximo, que --compare usa como margen de ruido."""
+    result = runs[-1]
+    flats = [flatten(run) for run in runs]
+    result['spread'] = {}
+    for key in flats[-1]:
+        if not key.endswith('_ms'):
+            continue
+        values = [flat[key] for flat in flats if key in flat]
+        *path, name = key.split('/')
+        node = result
+        for part in path:
+            node = node[part]
+        node[name] = min(values)
+        result['spread'][key] = max(values)
+    result['calibration_ms'] = round(sum(run['calibration_ms'] for run in runs) / len(runs), 3)
+    return result
+
+def run_entry(entry, repeat, engines):
+    grid = np.array(entry['grid'], dtype=np.int8)
+    pieces = [[tuple(cell) for cell in piece] for piece in entry['pieces']]
+    result = {'name': entry['name'], 'cells': int((grid != 0).sum()), 'pieces': len(pieces)}
+    result.update(bench_partition(entry, repeat))
+    if result['cells'] <= SOLVE_MAX_CELLS:
+        result['solve'] = bench_solve(grid, pieces, repeat)
+        if 'reference' in engines:
+            ms, _ = timed(lambda: app.find_solutions(grid, pieces, max_solutions=10, engine='reference'), 1)
+            result['reference_10_ms'] = ms
+    result['stl'] = {geometry: bench_stl(grid, pieces, geometry, repeat) for geometry in app.STL_GEOMETRY_MODES}
+    result['3mf'] = {geometry: bench_3mf(grid, pieces, geometry, repeat) for geometry in app.STL_GEOMETRY_MODES}
+    print(f"{entry['name']}: ok", file=sys.stderr)
+    return result
+
+def flatten(result):
+    """{'métrica/ruta': valor} de las métricas comparables de una entrada."""
+    flat = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, sub in value.items():
+                walk(f'{prefix}/{key}' if prefix else key, sub)
+        elif prefix.rsplit('/', 1)[-1] in COMPARED_METRICS and value is not None:
+            flat[prefix] = value
+    walk('', {key: value for key, value in result.items() if key != 'spread'})
+    return flat
+
+def compare(old, new, threshold, min_ms):
+    """Imprime las métricas que empeoran más de threshold y devuelve cuántas son.
+    Los tiempos se corrigen por la calibración de su entrada y además tienen que
+    quedar por encima del peor valor de la ejecución anterior (su 'spread'):
+    dentro de ese rango es ruido, igual que las subidas de menos de min_ms."""
+    old_by_name = {r['name']: r for r in old['results']}
+    regressions = 0
+    for result in new['results']:
+        old_result = old_by_name.get(result['name'])
+        if old_result is None:
+            continue
+        before = flatten(old_result)
+        speed = (result.get('calibration_ms', new['meta']['calibration_ms'])
+                 / old_result.get('calibration_ms', old['meta']['calibration_ms']))
+        if abs(speed - 1) <= CALIBRATION_NOISE:
+            speed = 1.0
+        spread = old_result.get('spread', {})
+        for key, value in flatten(result).items():
+            prev = before.get(key)
+            if not prev:
+                continue
+            timing = key.endswith('_ms')
+            if timing and value - prev < min_ms:
+                continue
+            ratio = value / prev / (speed if timing else 1.0)
+            if timing and value / speed <= spread.get(key, prev):
+                continue
+            if ratio > 1 + threshold:
+                regressions += 1
+                print(f"REGRESIÓN {result['name']} {key}: {prev} -> {value} (x{ratio:.2f})", file=sys.stderr)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks del generador de puzzles.')
+    parser.add_argument('--corpus', default=CORPUS_PATH)
+    parser.add_argument('--make-corpus', action='store_true', help='regenerar el corpus y salir')
+    parser.add_argument('--repeat', type=int, default=3, help='pasadas por el corpus (cada tiempo es el mínimo)')
+    parser.add_argument('--reference', action='store_true', help='medir también el motor de referencia')
+    parser.add_argument('--startup-only', action='store_true', help='medir solo el arranque')
+    parser.add_argument('--out', help='fichero JSON de salida (por defecto stdout)')
+    parser.add_argument('--compare', help='JSON de una ejecución anterior')
+    parser.add_argument('--threshold', type=float, default=0.2, help='empeoramiento tolerado en --compare')
+    parser.add_argument('--min-ms', type=float, default=1.0, help='subida mínima de un tiempo para contar como regresión')
+    args = parser.parse_args(argv)
+
+    if args.make_corpus:
+        with open(args.corpus, 'w') as f:
+            json.dump(make_corpus(), f)
+        return 0
+
+    with open(args.corpus) as f:
+        corpus = json.load(f)
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'corpus_generator_version': corpus['generator_version'],
+            'generator_version': app.GENERATOR_VERSION,
+            'repeat': args.repeat,
+        },
+        'results': [calibrated(lambda: {'name': 'startup', 'startup': bench_startup(max(args.repeat, 5))})],
+    }
+    if not args.startup_only:
+        report['results'] += run(corpus, args.repeat, ['reference'] if args.reference else [])
+    # Calibración global, solo para resultados antiguos sin calibración por entrada
+    report['meta']['calibration_ms'] = calibrate()
+    text = json.dumps(report, indent=1)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(json.load(f), report, args.threshold, args.min_ms) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+"""Configuración de Gunicorn. Procfile y render.yaml la cargan con -c; los
+parámetros de la línea de comandos (bind, threads...) tienen prioridad.
+
+WEB_CONCURRENCY (2 por defecto): nº de workers. Con más de uno, si no se ha
+fijado PUZZLE_STORE_URL los puzzles y los trabajos se guardan en SQLite
+(/tmp/puzzles.db): con el almacén en memoria de cada proceso una
+petición podría caer en un worker que no ha visto el puzzle.
+
+GUNICORN_PRELOAD (true por defecto): el maestro importa la app una sola vez y
+los workers la heredan al hacer fork, compartiendo la memoria (copy-on-write),
+en lugar de importarla cada uno al arrancar.
+PRELOAD_EXPORT_STACK (false por defecto): con preload, importa también numpy-stl
+y trimesh en el maestro. Arranque algo más lento a cambio de que la primera
+exportación no pague ese import.
+"""
+import os
+
+def env_flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+if workers > 1:
+    os.environ.setdefault('PUZZLE_STORE_URL', 'sqlite:////tmp/puzzles.db')
+
+preload_app = env_flag('GUNICORN_PRELOAD', 'true')
+
+def when_ready(server):
+    if preload_app and env_flag('PRELOAD_EXPORT_STACK', 'false'):
+        import app
+        server.log.info('Dependencias de exportación precargadas: %s', app.warm_export_stack())
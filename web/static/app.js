@@ -1,8 +1,12 @@
 // Estado global
 let puzzleData = {
+    puzzleId: null,
+    seed: null,
     grid: null,
     pieces: null,
     solutions: [],
+    symmetryOrder: 1,
+    solveJobId: null,
     currentSolutionIndex: -1,
     viewMode: 'isometric' // 'isometric' o '3d'
 };
@@ -35,8 +39,11 @@ document.getElementById('solve-50-btn').addEventListener('click', () => findSolu
 document.getElementById('next-btn').addEventListener('click', nextSolution);
 document.getElementById('prev-btn').addEventListener('click', prevSolution);
 document.getElementById('original-btn').addEventListener('click', showOriginal);
+document.getElementById('cancel-solve-btn').addEventListener('click', cancelSolve);
 const exportStlBtn = document.getElementById('export-stl-btn');
 if (exportStlBtn) exportStlBtn.addEventListener('click', exportSTL);
+const export3mfBtn = document.getElementById('export-3mf-btn');
+if (export3mfBtn) export3mfBtn.addEventListener('click', export3MF);
 
 // Utility Functions: separar estados de panel principal y visor 3D
 function showMainStatus(message, type = 'info') {
@@ -72,24 +79,40 @@ async function generatePuzzle() {
         const border_prob = parseInt(document.getElementById('border_prob').value) / 100;
         const air_prob = parseInt(document.getElementById('air_prob').value) / 100;
         const mode = document.getElementById('mode').value;
+        const unique = document.getElementById('unique').value === '1';
+        // Semilla vacía: el servidor elige una y la devuelve
+        const seedText = document.getElementById('seed').value.trim();
+        const seed = seedText === '' ? null : parseInt(seedText);
+
+        if (unique) showMainStatus('⏳ Buscando un puzzle de solución única...', 'info');
 
         const response = await fetch('/api/generate', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                M, N, min_size, max_size, border_prob, air_prob, mode
+                M, N, min_size, max_size, border_prob, air_prob, mode, unique, seed
             })
         });
 
         const data = await response.json();
 
         if (data.success) {
+            puzzleData.puzzleId = data.puzzle_id;
+            puzzleData.seed = data.seed;
             puzzleData.grid = data.grid;
             puzzleData.pieces = data.pieces;
-            puzzleData.solutions = [];
+            // Un puzzle de solución única ya trae su solución: la propia partición
+            puzzleData.solutions = data.unique_stats ? [data.pieces] : [];
+            puzzleData.symmetryOrder = 1;
+            puzzleData.solveJobId = null;
             puzzleData.currentSolutionIndex = -1;
 
-            showMainStatus(`✅ ${data.piece_count} piezas generadas`, 'success');
+            if (data.unique_stats) {
+                const st = data.unique_stats;
+                showMainStatus(`✅ ${data.piece_count} piezas, solución única (${st.attempts} intentos, ${st.elapsed.toFixed(1)} s) | Semilla: ${data.seed}`, 'success');
+            } else {
+                showMainStatus(`✅ ${data.piece_count} piezas generadas | Semilla: ${data.seed}`, 'success');
+            }
             // Mantener la vista actual (isometric por defecto si es primera vez)
             if (puzzleData.viewMode === 'flat') {
                 drawPuzzleFlat();
@@ -102,6 +125,8 @@ async function generatePuzzle() {
             if (typeof scheduleViewerUpdate === 'function') {
                 scheduleViewerUpdate();
             }
+        } else if (data.unique_stats) {
+            showMainStatus(`❌ ${data.error} (${data.unique_stats.attempts} intentos)`, 'error');
         } else {
             showMainStatus(`❌ Error: ${data.error}`, 'error');
         }
@@ -115,47 +140,105 @@ async function findSolutions(max_solutions) {
         showMainStatus('⚠️ Primero genera un puzzle', 'error');
         return;
     }
+    if (puzzleData.solveJobId) {
+        showMainStatus('⚠️ Ya hay una búsqueda en curso', 'error');
+        return;
+    }
 
     try {
         showMainStatus(`⏳ Buscando ${max_solutions} soluciones...`, 'info');
 
-        const response = await fetch('/api/find_solutions', {
+        const response = await fetch('/api/solve_jobs', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ max_solutions })
+            body: JSON.stringify({
+                max_solutions,
+                puzzle_id: puzzleData.puzzleId,
+                symmetry: document.getElementById('symmetry').value === '1'
+            })
         });
 
         const data = await response.json();
 
-        if (data.success) {
-            showMainStatus(`✅ ${data.solutions_count} soluciones encontradas`, 'success');
-            puzzleData.solutions = data.solutions_count;
-            puzzleData.currentSolutionIndex = -1;
-            updateSolutionInfo();
-        } else {
+        if (!data.success) {
             showMainStatus(`❌ Error: ${data.error}`, 'error');
+            return;
         }
+
+        puzzleData.solveJobId = data.job_id;
+        puzzleData.solutions = [];
+        puzzleData.symmetryOrder = 1;
+        puzzleData.currentSolutionIndex = -1;
+        updateSolutionInfo();
+        pollSolveJob(data.job_id, max_solutions);
+    } catch (error) {
+        showMainStatus(`❌ Error: ${error.message}`, 'error');
+    }
+}
+
+// Sondea el trabajo de búsqueda y va añadiendo las soluciones nuevas
+async function pollSolveJob(jobId, max_solutions) {
+    try {
+        while (puzzleData.solveJobId === jobId) {
+            const response = await fetch(`/api/solve_jobs/${jobId}?since=${puzzleData.solutions.length}`);
+            const data = await response.json();
+            if (!data.success) {
+                showMainStatus(`❌ Error: ${data.error}`, 'error');
+                break;
+            }
+
+            const job = data.job;
+            puzzleData.solutions.push(...job.solutions);
+            puzzleData.symmetryOrder = job.symmetry_order;
+            updateSolutionInfo();
+
+            const progress = `${job.solutions_count} soluciones | ${job.nodes} nodos | ${job.elapsed.toFixed(1)} s`;
+            if (job.status === 'done') {
+                showMainStatus(`✅ ${progress}`, 'success');
+                break;
+            } else if (job.status === 'cancelled') {
+                showMainStatus(`⏹ Búsqueda cancelada: ${progress}`, 'info');
+                break;
+            } else if (job.status === 'error') {
+                showMainStatus(`❌ Error: ${job.error}`, 'error');
+                break;
+            }
+            showMainStatus(`⏳ Buscando ${max_solutions} soluciones: ${progress}`, 'info');
+            await new Promise(resolve => setTimeout(resolve, 500));
+        }
+    } catch (error) {
+        showMainStatus(`❌ Error: ${error.message}`, 'error');
+    }
+    if (puzzleData.solveJobId === jobId) puzzleData.solveJobId = null;
+}
+
+async function cancelSolve() {
+    if (!puzzleData.solveJobId) return;
+    try {
+        await fetch(`/api/solve_jobs/${puzzleData.solveJobId}/cancel`, { method: 'POST' });
     } catch (error) {
         showMainStatus(`❌ Error: ${error.message}`, 'error');
     }
 }
 
 function nextSolution() {
-    if (puzzleData.solutions === 0) return;
+    const total = puzzleData.solutions.length;
+    if (total === 0) return;
     if (puzzleData.currentSolutionIndex === -1) {
         puzzleData.currentSolutionIndex = 0;
     } else {
-        puzzleData.currentSolutionIndex = (puzzleData.currentSolutionIndex + 1) % puzzleData.solutions;
+        puzzleData.currentSolutionIndex = (puzzleData.currentSolutionIndex + 1) % total;
     }
     updateSolutionInfo();
 }
 
 function prevSolution() {
-    if (puzzleData.solutions === 0) return;
+    const total = puzzleData.solutions.length;
+    if (total === 0) return;
     if (puzzleData.currentSolutionIndex === -1) {
-        puzzleData.currentSolutionIndex = puzzleData.solutions - 1;
+        puzzleData.currentSolutionIndex = total - 1;
     } else {
-        puzzleData.currentSolutionIndex = (puzzleData.currentSolutionIndex - 1 + puzzleData.solutions) % puzzleData.solutions;
+        puzzleData.currentSolutionIndex = (puzzleData.currentSolutionIndex - 1 + total) % total;
     }
     updateSolutionInfo();
 }
@@ -165,12 +248,25 @@ function showOriginal() {
     updateSolutionInfo();
 }
 
+// Piezas a dibujar: las originales o la colocación de la solución seleccionada
+function displayedPieces() {
+    if (puzzleData.currentSolutionIndex >= 0 && puzzleData.solutions[puzzleData.currentSolutionIndex]) {
+        return puzzleData.solutions[puzzleData.currentSolutionIndex];
+    }
+    return puzzleData.pieces;
+}
+
 function updateSolutionInfo() {
     const infoEl = document.getElementById('solution-info');
+    const total = puzzleData.solutions.length;
+    // Con reducción por simetría cada solución representa symmetryOrder soluciones
+    const found = puzzleData.symmetryOrder > 1
+        ? `${total} distintas (×${puzzleData.symmetryOrder} = ${total * puzzleData.symmetryOrder})`
+        : `${total}`;
     if (puzzleData.currentSolutionIndex === -1) {
-        infoEl.textContent = `Solución: 0 (Original) | Encontradas: ${puzzleData.solutions}`;
+        infoEl.textContent = `Solución: 0 (Original) | Encontradas: ${found}`;
     } else {
-        infoEl.textContent = `Solución: ${puzzleData.currentSolutionIndex + 1} | Encontradas: ${puzzleData.solutions}`;
+        infoEl.textContent = `Solución: ${puzzleData.currentSolutionIndex + 1} | Encontradas: ${found}`;
     }
     // Dibujar respetando la vista actual
     if (puzzleData.viewMode === 'flat') {
@@ -185,7 +281,7 @@ function drawPuzzle() {
     if (!puzzleData.grid || !puzzleData.pieces) return;
 
     const grid = puzzleData.grid;
-    const pieces = puzzleData.pieces;
+    const pieces = displayedPieces();
     const M = grid.length;
     const N = grid[0].length;
 
@@ -667,6 +763,35 @@ function drawFlatCellPlain(x, y, cellSize, color) {
     puzzleCtx.shadowColor = 'transparent';
 }
 
+// Parámetros de exportación del panel (comunes a STL y 3MF)
+function exportPayload() {
+    return {
+        cube_size: parseFloat(document.getElementById('stl_cube_size').value),
+        height: parseFloat(document.getElementById('stl_height').value),
+        gap_mm: parseFloat(document.getElementById('stl_gap').value),
+        tolerance_mm: parseFloat(document.getElementById('stl_tolerance').value),
+        border: parseFloat(document.getElementById('stl_border').value),
+        base_thickness: parseFloat(document.getElementById('stl_base_thickness').value),
+        wall_height: parseFloat(document.getElementById('stl_wall_height').value),
+        geometry: document.getElementById('stl_geometry').value,
+        layout: document.getElementById('stl_layout').value,
+        bed_width: parseFloat(document.getElementById('stl_bed_width').value),
+        bed_depth: parseFloat(document.getElementById('stl_bed_depth').value),
+        puzzle_id: puzzleData.puzzleId
+    };
+}
+
+function downloadBlob(blob, filename) {
+    const url = window.URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    a.href = url;
+    a.download = filename;
+    document.body.appendChild(a);
+    a.click();
+    window.URL.revokeObjectURL(url);
+    document.body.removeChild(a);
+}
+
 async function exportSTL() {
     if (!puzzleData.grid || !puzzleData.pieces) {
         showViewerStatus('⚠️ Primero genera un puzzle', 'error');
@@ -676,32 +801,13 @@ async function exportSTL() {
     try {
         showViewerStatus('⏳ Generando STL (base + piezas)...', 'info');
 
-        const payload = {
-            cube_size: parseFloat(document.getElementById('stl_cube_size').value),
-            height: parseFloat(document.getElementById('stl_height').value),
-            gap_mm: parseFloat(document.getElementById('stl_gap').value),
-            tolerance_mm: parseFloat(document.getElementById('stl_tolerance').value),
-            border: parseFloat(document.getElementById('stl_border').value),
-            base_thickness: parseFloat(document.getElementById('stl_base_thickness').value),
-            wall_height: parseFloat(document.getElementById('stl_wall_height').value)
-        };
-
-        const response = await fetch('/api/export_stl', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload)
-        });
+        const payload = exportPayload();
+
+        // GET para que el navegador pueda revalidar con ETag y reutilizar la descarga
+        const response = await fetch('/api/export_stl?' + new URLSearchParams(payload));
 
         if (response.ok) {
-            const blob = await response.blob();
-            const url = window.URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = 'puzzle_project.stl';
-            document.body.appendChild(a);
-            a.click();
-            window.URL.revokeObjectURL(url);
-            document.body.removeChild(a);
+            downloadBlob(await response.blob(), 'puzzle_project.stl');
             showViewerStatus('✅ STL descargado (base + piezas)', 'success');
         } else {
             const errorData = await response.json();
@@ -712,24 +818,36 @@ async function exportSTL() {
     }
 }
 
+// 3MF: una malla por forma de pieza y las copias como instancias
+async function export3MF() {
+    if (!puzzleData.grid || !puzzleData.pieces) {
+        showViewerStatus('⚠️ Primero genera un puzzle', 'error');
+        return;
+    }
+
+    try {
+        showViewerStatus('⏳ Generando 3MF (base + piezas)...', 'info');
+        const response = await fetch('/api/export_3mf?' + new URLSearchParams(exportPayload()));
+
+        if (response.ok) {
+            downloadBlob(await response.blob(), 'puzzle_project.3mf');
+            showViewerStatus('✅ 3MF descargado (base + piezas)', 'success');
+        } else {
+            const errorData = await response.json();
+            showViewerStatus(`❌ Error: ${errorData.error}`, 'error');
+        }
+    } catch (error) {
+        showViewerStatus(`❌ Error: ${error.message}`, 'error');
+    }
+}
+
 async function viewSTL() {
     try {
         showViewerStatus('⏳ Generando y cargando STL en el visor...', 'info');
-        const payload = {
-            cube_size: parseFloat(document.getElementById('stl_cube_size').value),
-            height: parseFloat(document.getElementById('stl_height').value),
-            gap_mm: parseFloat(document.getElementById('stl_gap').value),
-            tolerance_mm: parseFloat(document.getElementById('stl_tolerance').value),
-            border: parseFloat(document.getElementById('stl_border').value),
-            base_thickness: parseFloat(document.getElementById('stl_base_thickness').value),
-            wall_height: parseFloat(document.getElementById('stl_wall_height').value)
-        };
-
-        const response = await fetch('/api/export_stl', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload)
-        });
+        const payload = exportPayload();
+
+        // GET para que el navegador pueda revalidar con ETag y reutilizar la descarga
+        const response = await fetch('/api/export_stl?' + new URLSearchParams(payload));
 
         if (!response.ok) {
             const errorData = await response.json();
@@ -816,7 +934,7 @@ function drawPuzzleFlat() {
     if (!puzzleData.grid || !puzzleData.pieces) return;
 
     const grid = puzzleData.grid;
-    const pieces = puzzleData.pieces;
+    const pieces = displayedPieces();
     const M = grid.length;
     const N = grid[0].length;
     const w = puzzleCanvas.width;
@@ -1005,8 +1123,13 @@ const tolInput = document.getElementById('stl_tolerance');
 const borderInput = document.getElementById('stl_border');
 const baseThkInput = document.getElementById('stl_base_thickness');
 const wallHInput = document.getElementById('stl_wall_height');
+const geometryInput = document.getElementById('stl_geometry');
+const layoutInput = document.getElementById('stl_layout');
+const bedWidthInput = document.getElementById('stl_bed_width');
+const bedDepthInput = document.getElementById('stl_bed_depth');
 
-[cubeInput, heightInput, gapInput, tolInput, borderInput, baseThkInput, wallHInput].forEach(inp => {
+[cubeInput, heightInput, gapInput, tolInput, borderInput, baseThkInput, wallHInput, geometryInput,
+    layoutInput, bedWidthInput, bedDepthInput].forEach(inp => {
     if (inp) {
         inp.addEventListener('input', scheduleViewerUpdate);
         inp.addEventListener('change', scheduleViewerUpdate);
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# app.py es un módulo suelto en web/, como lo arranca Gunicorn
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
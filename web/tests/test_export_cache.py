@@ -0,0 +1,23 @@
+import pytest
+
+import app
+
+def test_key_depends_on_format_and_version(monkeypatch):
+    params = {'cube_size': 10.0, 'tolerance_mm': 0.3}
+    stl = app.export_cache_key('p', **params)
+    assert stl == app.export_cache_key('p', ext='stl', **params)
+    assert stl != app.export_cache_key('p', ext='3mf', **params)
+    monkeypatch.setattr(app, 'EXPORT_FORMAT_VERSION', app.EXPORT_FORMAT_VERSION + 1)
+    assert stl != app.export_cache_key('p', **params)
+
+def test_merged_needs_positive_tolerance():
+    client = app.app.test_client()
+    grid, pieces = app.generate_puzzle(4, 4, rng=0)
+    puzzle_id = app.new_puzzle(grid, pieces)
+    for route in ('/api/export_stl', '/api/export_3mf'):
+        response = client.post(route, json={'puzzle_id': puzzle_id, 'geometry': 'merged', 'tolerance_mm': 0})
+        assert response.status_code == 400
+    response = client.post('/api/export_stl', json={'puzzle_id': puzzle_id, 'geometry': 'boxes', 'tolerance_mm': 0})
+    assert response.status_code == 200
+    with pytest.raises(ValueError):
+        app.batch_tasks({'stl': True, 'geometry': 'merged', 'tolerance_mm': 0})
@@ -0,0 +1,45 @@
+import random
+
+import pytest
+
+import app
+
+def check_plates(sizes, placements, widths, bed_width, bed_depth, gap):
+    """Cada rectángulo dentro de su placa (de la cama si cabe en ella) y sin
+    solaparse con los demás de la misma placa, contando la separación."""
+    rects = {}
+    for (w, h), (plate, x, y, rotated) in zip(sizes, placements):
+        if rotated:
+            w, h = h, w
+        fits_bed = (w <= bed_width and h <= bed_depth) or (h <= bed_width and w <= bed_depth)
+        if fits_bed:
+            assert x + w <= bed_width + 1e-6 and y + h <= bed_depth + 1e-6
+        else:
+            assert (x, y) == (0.0, 0.0)
+        assert x + w <= widths[plate] + 1e-6
+        rects.setdefault(plate, []).append((x, y, w, h, fits_bed))
+    for items in rects.values():
+        if any(not fits for *_, fits in items):
+            assert len(items) == 1
+        for i, (x, y, w, h, _) in enumerate(items):
+            for ox, oy, ow, oh, _ in items[i + 1:]:
+                assert (x + w + gap <= ox + 1e-6 or ox + ow + gap <= x + 1e-6
+                        or y + h + gap <= oy + 1e-6 or oy + oh + gap <= y + 1e-6)
+
+def test_oversized_item_gets_its_own_plate():
+    sizes = [(300, 150)] + [(20, 20)] * 30
+    placements, widths = app.pack_plates(sizes, 220, 220, 5, [False] + [True] * 30)
+    assert all(plate != placements[0][0] for plate, *_ in placements[1:])
+    check_plates(sizes, placements, widths, 220, 220, 5)
+
+@pytest.mark.parametrize('seed', range(300))
+def test_random_packing_stays_on_bed(seed):
+    rng = random.Random(seed)
+    bed_width, bed_depth, gap = rng.choice([(220, 220), (180, 250), (120, 120)]) + (rng.choice([0, 2, 5]),)
+    sizes = [(rng.randint(1, 8) * 10, rng.randint(1, 8) * 10) for _ in range(rng.randint(1, 40))]
+    if rng.random() < 0.3:
+        sizes.append((rng.randint(100, 400), rng.randint(100, 400)))
+    rotatable = [rng.random() < 0.8 for _ in sizes]
+    placements, widths = app.pack_plates(sizes, bed_width, bed_depth, gap, rotatable)
+    assert all(not rotated or rot_ok for (*_, rotated), rot_ok in zip(placements, rotatable))
+    check_plates(sizes, placements, widths, bed_width, bed_depth, gap)
@@ -0,0 +1,40 @@
+import pytest
+
+import app
+
+CACHE_MAX = 5
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'SOLUTIONS_CACHE_MAX', CACHE_MAX)
+    return app.app.test_client()
+
+@pytest.fixture
+def puzzle_id():
+    # Rectángulo abierto 5x5: 128 soluciones
+    grid, pieces = app.generate_puzzle(5, 5, border_prob=0, air_prob=0, rng=0)
+    return app.new_puzzle(grid, pieces)
+
+def all_solutions(puzzle_id):
+    puzzle = app.PUZZLE_STORE.get(puzzle_id)
+    return app.find_solutions(puzzle['grid'], puzzle['pieces'])
+
+@pytest.mark.parametrize('max_solutions', [CACHE_MAX + 1, 1000])
+def test_find_solutions_respects_cache_max(client, puzzle_id, max_solutions):
+    response = client.post('/api/find_solutions', json={'puzzle_id': puzzle_id, 'max_solutions': max_solutions})
+    assert response.get_json()['success']
+    puzzle = app.PUZZLE_STORE.get(puzzle_id)
+    assert len(puzzle['solutions']) == CACHE_MAX
+    assert not puzzle['solutions_complete']
+
+def test_parallel_result_is_not_saved_truncated(client, puzzle_id):
+    client.post('/api/find_solutions', json={'puzzle_id': puzzle_id, 'max_solutions': 1000, 'parallel': True})
+    puzzle = app.PUZZLE_STORE.get(puzzle_id)
+    assert puzzle['solutions'] == []
+
+def test_pages_continue_after_truncated_cache(client, puzzle_id):
+    client.post('/api/find_solutions', json={'puzzle_id': puzzle_id, 'max_solutions': 1000})
+    page = client.get(f'/api/solutions?puzzle_id={puzzle_id}&offset=0&limit=20').get_json()
+    expected = [{frozenset(piece) for piece in solution} for solution in all_solutions(puzzle_id)[:20]]
+    got = [{frozenset(map(tuple, piece)) for piece in solution} for solution in page['solutions']]
+    assert got == expected
@@ -0,0 +1,42 @@
+import time
+
+import app
+
+def wait_final(job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = app.JOB_STORE.get(job_id)
+        if job['status'] in app.SOLVE_JOB_FINAL_STATES:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'el trabajo {job_id} no ha terminado')
+
+def new_job(max_solutions=10, **puzzle_args):
+    grid, pieces = app.generate_puzzle(rng=0, **puzzle_args)
+    puzzle_id = app.new_puzzle(grid, pieces)
+    return app.submit_solve_job(puzzle_id, max_solutions)
+
+def test_job_finishes():
+    job = wait_final(new_job())
+    assert job['status'] == 'done'
+    assert 0 < len(job['solutions']) <= 10
+
+def test_cancel_reaches_a_final_state():
+    job_id = new_job(max_solutions=app.SOLVE_JOB_MAX_SOLUTIONS, M=6, N=6, border_prob=0, air_prob=0)
+    app.cancel_solve_job(job_id)
+    assert wait_final(job_id)['status'] in ('cancelled', 'done')
+
+def test_cancel_does_not_overwrite_a_finished_job(monkeypatch):
+    # El trabajo termina entre la lectura de cancel_solve_job y su marca
+    job_id = 'carrera'
+    app.JOB_STORE.put(job_id, {'puzzle_id': None, 'status': 'running', 'nodes': 0, 'elapsed': 0.0,
+                               'solutions': [], 'error': None})
+    put = app.JOB_CANCEL_STORE.put
+
+    def finish_then_put(key, value):
+        app.JOB_STORE.put(job_id, dict(app.JOB_STORE.get(job_id), status='done'))
+        put(key, value)
+
+    monkeypatch.setattr(app.JOB_CANCEL_STORE, 'put', finish_then_put)
+    assert app.cancel_solve_job(job_id)['status'] == 'done'
+    assert app.JOB_STORE.get(job_id)['status'] == 'done'
@@ -0,0 +1,80 @@
+import pytest
+
+import app
+
+# Tableros pequeños para que el motor de referencia termine rápido. Los de
+# aire y bordes a cero son rectángulos abiertos, con simetrías aprovechables.
+BOARDS = [
+    (4, 4, app.DEFAULT_BORDER_PROB, app.DEFAULT_AIR_PROB),
+    (4, 5, app.DEFAULT_BORDER_PROB, app.DEFAULT_AIR_PROB),
+    (5, 5, app.DEFAULT_BORDER_PROB, app.DEFAULT_AIR_PROB),
+    (4, 4, 0, 0),
+    (5, 5, 0, 0),
+    (4, 6, 0, 0),
+]
+CASES = [(board, seed) for board in BOARDS for seed in range(4)]
+
+def case_id(case):
+    (M, N, border_prob, air_prob), seed = case
+    return f'{M}x{N}-{"abierto" if not border_prob and not air_prob else "aleatorio"}-{seed}'
+
+def solution_set(solutions):
+    return {frozenset(solution) for solution in solutions}
+
+def transform_solution(solution, perm, N):
+    """Aplica una simetría del tablero (permutación de bits) a una solución."""
+    return frozenset(frozenset(divmod(int(perm[r * N + c]), N) for r, c in piece) for piece in solution)
+
+@pytest.fixture(params=CASES, ids=[case_id(case) for case in CASES])
+def puzzle(request):
+    (M, N, border_prob, air_prob), seed = request.param
+    grid, pieces = app.generate_puzzle(M, N, border_prob=border_prob, air_prob=air_prob, rng=seed)
+    reference = solution_set(app.find_solutions(grid, pieces, engine='reference'))
+    return grid, pieces, reference
+
+def test_exact_cover_matches_reference(puzzle):
+    grid, pieces, reference = puzzle
+    solutions = app.find_solutions(grid, pieces, engine='exact_cover')
+    assert len(solutions) == len(reference)
+    assert solution_set(solutions) == reference
+
+def test_max_solutions_is_a_subset(puzzle):
+    grid, pieces, reference = puzzle
+    solutions = app.find_solutions(grid, pieces, max_solutions=3)
+    assert len(solutions) == min(3, len(reference))
+    assert solution_set(solutions) <= reference
+
+def test_symmetry_covers_every_solution(puzzle):
+    grid, pieces, reference = puzzle
+    stats = {}
+    distinct = app.find_solutions(grid, pieces, symmetry=True, stats=stats)
+    assert len(distinct) * stats['symmetry_order'] == len(reference)
+    assert solution_set(distinct) <= reference
+    N = grid.shape[1]
+    orbits = {transform_solution(solution, perm, N)
+              for solution in distinct for perm in app.board_symmetries(grid)}
+    assert orbits == reference
+
+@pytest.mark.parametrize('symmetry', [False, True])
+@pytest.mark.parametrize('seed', range(2))
+def test_parallel_matches_reference(monkeypatch, seed, symmetry):
+    # Con una sola CPU el modo paralelo se haría en línea: se fuerzan dos procesos
+    monkeypatch.setattr(app, 'SOLVER_WORKERS', 2)
+    grid, pieces = app.generate_puzzle(5, 5, border_prob=0, air_prob=0, rng=seed)
+    reference = solution_set(app.find_solutions(grid, pieces, engine='reference'))
+    stats = {}
+    solutions = app.find_solutions(grid, pieces, parallel=True, workers=2, symmetry=symmetry, stats=stats)
+    assert len(solutions) * stats['symmetry_order'] == len(reference)
+    if symmetry:
+        assert solution_set(solutions) <= reference
+    else:
+        assert solution_set(solutions) == reference
+
+def test_reference_rejects_exact_cover_options():
+    grid, pieces = app.generate_puzzle(4, 4, rng=0)
+    with pytest.raises(ValueError):
+        app.find_solutions(grid, pieces, engine='reference', parallel=True)
+    with pytest.raises(ValueError):
+        app.find_solutions(grid, pieces, engine='reference', symmetry=True)
+    with pytest.raises(ValueError):
+        app.find_solutions(grid, pieces, engine='desconocido')